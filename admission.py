@@ -0,0 +1,127 @@
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+
+from metrics import ADMISSION_REJECTED, ADMISSION_WAITING
+
+# Set limits for browser sessions on the whole host (shared by all Gunicorn workers)
+MAX_BROWSER_SESSIONS = 6  # Browser sessions (ILIAS logins and in-browser scrapes) running at once
+BROWSER_MEMORY_BUDGET_MB = 2048  # Memory the browser sessions of all workers may use together
+BROWSER_SESSION_MEMORY_MB = 350  # Estimated memory of one browser session (context, pages, renderer)
+WARM_BROWSER_MEMORY_MB = 150  # Estimated memory of one idle pre-launched browser, taken from the budget
+WEB_WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))  # Gunicorn workers on the host, each with its own warm browsers
+MIN_FREE_MEMORY_MB = 512  # Do not start a session if less memory than this would be left on the host
+ADMISSION_QUEUE_SIZE = 20  # Requests per worker waiting for a session before new ones are rejected
+ADMISSION_MAX_WAIT = 60  # Seconds a request waits for a session before it is rejected
+ADMISSION_POLL_INTERVAL = 0.25  # Seconds between attempts to take a free session slot
+ADMISSION_RETRY_AFTER = 30  # Retry-After (seconds) sent with rejected requests
+ADMISSION_LOCK_DIR = os.path.join(tempfile.gettempdir(), "hnunisync-admission")
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, message, retry_after=ADMISSION_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Available memory of the host in MB, or None where /proc/meminfo does not exist
+def available_memory_mb():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# A taken session slot: an exclusive lock on one of the slot files. The kernel drops the
+# lock when the process dies, so a crashed worker never leaks its slots.
+class BrowserSessionSlot:
+    def __init__(self, index, fd):
+        self.index = index
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+# Host-wide admission control for browser sessions. Every session holds one of a fixed
+# number of lock files, so the limit holds across all worker processes. The warm browsers
+# of all workers are always running, so their memory is taken from the budget. Within a worker,
+# waiting requests are served in arrival order; the queue and the wait are bounded, and
+# rejected requests are told when to retry instead of piling up.
+class BrowserAdmission:
+    def __init__(
+        self,
+        max_sessions: int = MAX_BROWSER_SESSIONS,
+        memory_budget_mb: int = BROWSER_MEMORY_BUDGET_MB,
+        session_memory_mb: int = BROWSER_SESSION_MEMORY_MB,
+        warm_browsers: int = 0,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        lock_dir: str = ADMISSION_LOCK_DIR,
+    ):
+        sessions_budget_mb = memory_budget_mb - warm_browsers * WARM_BROWSER_MEMORY_MB
+        self.slots = max(1, min(max_sessions, sessions_budget_mb // session_memory_mb))
+        self.session_memory_mb = session_memory_mb
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.lock_dir = lock_dir
+        self._waiters = deque()
+
+    # Starting another session must leave enough memory for the rest of the host
+    def _memory_available(self):
+        available = available_memory_mb()
+        return available is None or available - self.session_memory_mb >= MIN_FREE_MEMORY_MB
+
+    def _try_acquire(self):
+        if not self._memory_available():
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        for index in range(self.slots):
+            fd = os.open(os.path.join(self.lock_dir, f"slot-{index}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return BrowserSessionSlot(index, fd)
+        return None
+
+    # Wait for a free session slot. Raises AdmissionRejectedError right away if too many
+    # requests are waiting already, or once max_wait seconds have passed.
+    async def acquire(self):
+        if len(self._waiters) >= self.queue_size:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            logging.warning(f"Rejecting browser session: {len(self._waiters)} requests are waiting already")
+            raise AdmissionRejectedError("Too many ILIAS logins in progress. Please try again later.")
+
+        ticket = object()
+        self._waiters.append(ticket)
+        ADMISSION_WAITING.inc()
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                # Only the longest waiting request of this worker competes for a slot
+                if self._waiters[0] is ticket:
+                    slot = self._try_acquire()
+                    if slot is not None:
+                        return slot
+                if time.monotonic() >= deadline:
+                    ADMISSION_REJECTED.labels("timeout").inc()
+                    logging.warning(f"Rejecting browser session after waiting {self.max_wait} seconds")
+                    raise AdmissionRejectedError("The server is busy with other ILIAS logins. Please try again later.")
+                await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+        finally:
+            self._waiters.remove(ticket)
+            ADMISSION_WAITING.dec()
+
@@ -3,23 +3,32 @@
 from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-from bs4 import BeautifulSoup
-import re
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
+from contextlib import asynccontextmanager
 from typing import List
 import uuid
+import weakref
+import httpx
 import asyncio
 import logging
 
+from admission import AdmissionRejectedError
+from browser_pool import browser_pool, BrowserPoolBusyError, BROWSER_USER_AGENT, BROWSER_CONTEXT_WAIT
+from ilias_parser import parse_courses, parse_members_page
+from jobs import job_manager, JobQueueFullError, FINISHED_STATES
+from matrix_sessions import matrix_sessions
+from metrics import timed, collect_timings, format_timings, render_metrics
+from snapshot_store import snapshot_store
+
 # Import Matrix functions from script.py
 from script import (
-    login,
-    create_room,
-    invite_users_to_room,
-    logout,
+    provision_room,
+    sync_room_members,
+    remove_missing_members,
+    RoomAccessError,
     find_room_by_name,
     matrix_domain
 )
@@ -31,7 +40,21 @@ logging.basicConfig(
     format='%(asctime)s %(levelname)s:%(message)s'
 )
 
-app = FastAPI()
+
+# Start the shared browser pool, the job workers and the Matrix session pool with the
+# application and shut them down cleanly on exit
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await browser_pool.start()
+    await job_manager.start()
+    await matrix_sessions.start()
+    yield
+    await job_manager.stop()
+    await matrix_sessions.stop()
+    await browser_pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS to allow requests from frontend
 app.add_middleware(
@@ -63,11 +86,50 @@ demo_students_emails = [
 
 #demo_students_emails = [f"demo.user{i}@hs-heilbronn.de" for i in range(1, 12)]
 
+# Set limits for concurrent ILIAS scraping
+MAX_CONCURRENT_COURSE_PAGES = 4  # Tabs per login used to scrape course member pages (1 = one after another)
+MAX_CONCURRENT_COURSE_REQUESTS = 8  # Pooled HTTP connections per login used to fetch course member pages
+HTTP_COURSE_FETCH_TIMEOUT = 30  # Seconds per ILIAS page request on the HTTP fast path
+FETCH_COURSE_PAGES_OVER_HTTP = True  # Release the browser after login and fetch course pages with httpx
+MEMBER_TABLE_MAX_ROWS = 800  # Largest rows-per-page setting of ILIAS tables, requested when a members table is paged
+
+# Set limits for concurrent Matrix synchronization
+MAX_CONCURRENT_COURSE_SYNCS = 4  # Courses synced at the same time per request
+
+# Navigation settings per page type: resource types blocked while the page loads, the
+# load state to wait for and an optional selector that marks the page as ready. The
+# scrapers only read the server-rendered HTML, so ILIAS pages load without any assets.
+BLOCK_RESOURCES = True  # Abort requests for the blocked resource types below
+NAVIGATION_SETTINGS = {
+    "login": {
+        "blocked_resources": {"image", "media", "font"},
+        "wait_until": "domcontentloaded",
+        "ready_selector": 'input[name="username"]'
+    },
+    "course_list": {
+        "blocked_resources": {"image", "media", "font", "stylesheet", "script", "xhr", "fetch"},
+        "wait_until": "domcontentloaded",
+        "ready_selector": None
+    },
+    "course_members": {
+        "blocked_resources": {"image", "media", "font", "stylesheet", "script", "xhr", "fetch"},
+        "wait_until": "domcontentloaded",
+        "ready_selector": None
+    },
+}
+
+# Page type of the last navigation of every page, used by the request router
+page_types = weakref.WeakKeyDictionary()
+
+ILIAS_BASE_URL = 'https://ilias.hs-heilbronn.de'
+COURSE_LIST_URL = f'{ILIAS_BASE_URL}/ilias.php?cmdClass=ilmembershipoverviewgui&cmdNode=jr&baseClass=ilmembershipoverviewgui'
+
 # Define Pydantic models to handle incoming JSON data
 class LoginData(BaseModel):
     username: str
     password: str
     loginOtp: str
+    refresh: bool = False  # Re-scrape only stale courses and serve the rest from the snapshot store
 
 
 class Course(BaseModel):
@@ -80,6 +142,18 @@ class MatrixLoginData(BaseModel):
     userId: str
     password: str
     courses: List[Course]
+    removeMissing: bool = False  # Also remove room members who are no longer enrolled
+
+
+class MatrixCredentials(BaseModel):
+    userId: str
+    password: str
+
+
+class IliasMatrixSyncData(LoginData):
+    matrixUserId: str
+    matrixPassword: str
+    removeMissing: bool = False
 
 
 # Function to convert email addresses to Matrix user IDs and exclude the logged-in user
@@ -95,78 +169,263 @@ def convert_emails_to_matrix_user_ids(emails, logged_in_user):
     return matrix_user_ids
 
 
+# Sync a single course: find or create its room and bring the room members in line with
+# the ILIAS member list. Failures are returned as an error entry for the course.
+async def sync_course_with_matrix(client, course, matrix_user_id, room_name_lock, progress=None):
+    room_name = course.course_name
+    matrix_user_ids = convert_emails_to_matrix_user_ids(course.students, matrix_user_id)
+
+    #adding demo matrix user ids from demo student emails
+    #matrix_demo_user_ids = convert_emails_to_matrix_user_ids(demo_students_emails, matrix_user_id)
+    #matrix_user_ids = matrix_user_ids + matrix_demo_user_ids
+
+    logging.info(f"Matrix User ids are listed: {matrix_user_ids}")
+
+    logging.info(f"Processing course: {room_name}")
+
+    # A room from the cached room index may have been left since; its lookup is then
+    # repeated once on a freshly built index
+    for attempt in range(2):
+        # Courses with the same name share one room, so they must not create it twice
+        async with room_name_lock:
+            # Step 2.1: Check if the room already exists (async function call)
+            room_id = await find_room_by_name(client, room_name)
+            initial_invites = None
+
+            # Step 2.2: If the room doesn't exist, create it with encryption and the first
+            # students invited in a single request (async function call)
+            if not room_id:
+                logging.info(f"Room '{room_name}' does not exist. Creating a new one...")
+                room_id, initial_invites = await provision_room(
+                    client, room_name, f"Room for {room_name}", matrix_user_ids)
+                if not room_id:
+                    logging.error(f"Failed to create room '{room_name}' for user {matrix_user_id}")
+                    return {"course_name": room_name, "course_id": course.course_id, "error": f"Failed to create room {room_name}."}
+
+        # Step 3: Invite only the users who are not joined or invited yet
+        try:
+            member_sync = await sync_room_members(
+                client, room_id, matrix_user_ids, progress=progress,
+                initial_invites=initial_invites)
+            break
+        except RoomAccessError as e:
+            logging.warning(f"Looking up room '{room_name}' again: {e}")
+            if attempt == 1:
+                return {"course_name": room_name, "course_id": course.course_id, "error": f"No access to room {room_name}."}
+
+    room_members = member_sync["skipped"] + member_sync["added"]
+    room_members.append(f"@{matrix_user_id}:{matrix_domain}")
+    logging.info(
+        f"Synced members of room '{room_name}': {len(member_sync['added'])} added, "
+        f"{len(member_sync['skipped'])} skipped, {len(member_sync['failed'])} failed, "
+        f"{len(member_sync['missing'])} without Matrix account")
+    return {
+        "room_name": room_name,
+        "room_id": room_id,
+        "members": room_members,
+        "added": len(member_sync["added"]),
+        "skipped": len(member_sync["skipped"]),
+        "failed": len(member_sync["failed"]),
+        "missing": len(member_sync["missing"]),
+        "missing_users": member_sync["missing"],
+        "removed": 0
+    }
+
+
+# Endpoint to end the Matrix session kept for reuse between syncs
+@app.post("/matrix-logout")
+async def matrix_logout(credentials: MatrixCredentials):
+    if not await matrix_sessions.invalidate(credentials.userId, credentials.password):
+        raise HTTPException(status_code=404, detail="No Matrix session found.")
+    return {"status": "success", "message": "Matrix session ended."}
+
+
 # Endpoint to sync with Matrix and invite users to rooms
 @app.post("/sync-with-matrix")
-async def sync_with_matrix(matrix_login_data: MatrixLoginData):
+async def sync_with_matrix(matrix_login_data: MatrixLoginData, timings: bool = False):
+    return await with_timings(run_matrix_sync(matrix_login_data), timings)
+
+
+# Create the rooms and invite the students of all courses. Progress events are passed
+# to the optional progress callback (used by background jobs).
+async def run_matrix_sync(matrix_login_data: MatrixLoginData, progress=None):
     matrix_user_id = matrix_login_data.userId  # Logged-in Matrix user ID
     matrix_password = matrix_login_data.password
     courses = matrix_login_data.courses
 
     logging.info(f"Matrix sync initiated by user: {matrix_user_id}")
 
-    # Step 1: Login to Matrix (async function call)
-    client = await login(matrix_user_id, matrix_password)
+    # Step 1: Login to Matrix, reusing the user's session from an earlier sync if there is one
+    with timed("matrix_login"):
+        client = await matrix_sessions.acquire(matrix_user_id, matrix_password)
     if not client:
         logging.error(f"Login to Matrix failed for user {matrix_user_id}")
         raise HTTPException(status_code=401, detail="Login to Matrix failed.")
 
-    try:
-        # Step 2: Create rooms for each course and invite students
-        rooms = []
-        for course in courses:
-            room_name = course.course_name
-            matrix_user_ids = convert_emails_to_matrix_user_ids(course.students, matrix_user_id)
+    if progress:
+        progress({"stage": "matrix_logged_in", "total_courses": len(courses)})
 
-            #adding demo matrix user ids from demo student emails
-            #matrix_demo_user_ids = convert_emails_to_matrix_user_ids(demo_students_emails, matrix_user_id)
-            #matrix_user_ids = matrix_user_ids + matrix_demo_user_ids
+    try:
+        # Step 2: Create rooms for the courses and invite students, several courses at a time.
+        # All invites share the budget of the Matrix rate limiter.
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_COURSE_SYNCS)
+        room_name_locks = {}
 
-            logging.info(f"Matrix User ids are listed: {matrix_user_ids}")
+        async def sync_course_task(course):
+            async with semaphore:
+                return await sync_course_isolated(client, course, matrix_user_id, room_name_locks, progress)
 
-            logging.info(f"Processing course: {room_name}")
+        course_results = await asyncio.gather(*(sync_course_task(course) for course in courses))
+        if matrix_login_data.removeMissing:
+            await remove_missing_room_members(client, list(zip(courses, course_results)), matrix_user_id)
 
-            # Step 2.1: Check if the room already exists (async function call)
-            room_id = await find_room_by_name(client, room_name)
+    finally:
+        # Step 4: Hand the session back; it stays logged in for the next sync for a while
+        await matrix_sessions.release(client)
 
-            # Step 2.2: If the room doesn't exist, create a new one (async function call)
-            if not room_id:
-                logging.info(f"Room '{room_name}' does not exist. Creating a new one...")
-                room_id = await create_room(client, room_name, f"Room for {room_name}")
-                if not room_id:
-                    logging.error(f"Failed to create room '{room_name}' for user {matrix_user_id}")
-                    raise HTTPException(status_code=500, detail=f"Failed to create room {room_name}.")
-
-            # Step 3: Invite users to the room (async function call)
-            added_member_list_into_matrix_rooms = await invite_users_to_room(client, room_id, matrix_user_ids)
-
-            if added_member_list_into_matrix_rooms:
-                added_member_list_into_matrix_rooms.append(f"@{matrix_user_id}:{matrix_domain}")
-                rooms.append({
-                    "room_name": room_name,
-                    "room_id": room_id,
-                    "members": added_member_list_into_matrix_rooms
-                })
-                logging.info(f"Users invited to room '{room_name}': {added_member_list_into_matrix_rooms}")
+    logging.info(f"Matrix sync completed successfully for user {matrix_user_id}")
+    return build_sync_response(course_results)
 
-        # Step 4: Logout after completing the task (async function call)
-        await logout(client)
 
+# Sync one course, turning any error into an error entry so the other courses go on
+async def sync_course_isolated(client, course, matrix_user_id, room_name_locks, progress=None):
+    room_name_lock = room_name_locks.setdefault(course.course_name, asyncio.Lock())
+    if progress:
+        progress({"stage": "course_started", "course_name": course.course_name})
+    try:
+        with timed("matrix_course_sync"):
+            result = await sync_course_with_matrix(
+                client, course, matrix_user_id, room_name_lock, progress)
     except Exception as e:
-        logging.exception(f"An error occurred during synchronization for user {matrix_user_id}: {e}")
-        await logout(client)
-        raise HTTPException(status_code=500, detail=f"An error occurred during synchronization: {e}")
-
-    logging.info(f"Matrix sync completed successfully for user {matrix_user_id}")
+        logging.exception(f"Failed to sync course '{course.course_name}' for user {matrix_user_id}: {e}")
+        result = {
+            "course_name": course.course_name,
+            "course_id": course.course_id,
+            "error": f"An error occurred during synchronization: {e}"
+        }
+    if progress:
+        progress({"stage": "course_synced", "course_name": course.course_name, "error": result.get("error")})
+    return result
+
+
+# Remove the room members that no course lists any more, once all courses are synced.
+# Courses with the same name share one room, so a room is compared against the students
+# of all its courses together. If one of them failed, its students are unknown and
+# nothing is removed from that room. synced_courses holds (course, result) pairs; the
+# removals are counted on the first result of each room.
+async def remove_missing_room_members(client, synced_courses, matrix_user_id):
+    failed_names = {result["course_name"] for course, result in synced_courses if "error" in result}
+    rooms = {}
+    for course, result in synced_courses:
+        if "error" in result or result["room_name"] in failed_names:
+            continue
+        first_result, wanted = rooms.setdefault(result["room_id"], (result, set()))
+        wanted.update(convert_emails_to_matrix_user_ids(course.students, matrix_user_id))
+
+    for room_name in sorted(failed_names):
+        logging.warning(f"Not removing members from room '{room_name}': one of its courses failed")
+    for room_id, (first_result, wanted) in rooms.items():
+        try:
+            removed = await remove_missing_members(client, room_id, sorted(wanted))
+        except RoomAccessError as e:
+            logging.warning(f"Not removing members from room '{first_result['room_name']}': {e}")
+            continue
+        first_result["removed"] = len(removed)
+        logging.info(f"Removed {len(removed)} members no longer enrolled from room '{first_result['room_name']}'")
+
+
+def build_sync_response(course_results):
+    rooms = [result for result in course_results if "error" not in result]
+    failed_courses = [result for result in course_results if "error" in result]
     return {
         "status": "success",
-        "message": "Rooms created and users invited successfully.",
-        "rooms": rooms
+        "message": "Rooms created and users invited successfully." if not failed_courses
+        else f"Rooms synchronized, {len(failed_courses)} course(s) failed.",
+        "rooms": rooms,
+        "failed_courses": failed_courses,
+        "summary": {
+            key: sum(room[key] for room in rooms) for key in ("added", "skipped", "failed", "missing", "removed")
+        }
     }
 
 
+# Endpoint that scrapes ILIAS and syncs with Matrix in one go. Each course is handed to
+# the Matrix workers as soon as its members are scraped, so room creation and invites
+# overlap with scraping the remaining courses.
+@app.post("/ilias-sync-with-matrix")
+async def ilias_sync_with_matrix(sync_data: IliasMatrixSyncData, timings: bool = False):
+    return await with_timings(run_ilias_matrix_pipeline(sync_data), timings)
+
+
+async def run_ilias_matrix_pipeline(sync_data: IliasMatrixSyncData, progress=None):
+    matrix_user_id = sync_data.matrixUserId
+    logging.info(f"ILIAS to Matrix sync initiated by user: {matrix_user_id}")
+
+    # Log in to Matrix first so wrong Matrix credentials fail before the ILIAS OTP is used
+    with timed("matrix_login"):
+        client = await matrix_sessions.acquire(matrix_user_id, sync_data.matrixPassword)
+    if not client:
+        logging.error(f"Login to Matrix failed for user {matrix_user_id}")
+        raise HTTPException(status_code=401, detail="Login to Matrix failed.")
+
+    course_queue = asyncio.Queue()
+    room_name_locks = {}
+    synced_courses = []
+
+    async def matrix_worker():
+        while True:
+            scraped_course = await course_queue.get()
+            if scraped_course is None:
+                return
+            course, emails, error = scraped_course
+            if error is not None:
+                synced_courses.append((None, {"course_name": course['name'], "course_id": course['refId'], "error": error}))
+                continue
+            course_data = Course(course_name=course['name'], course_id=course['refId'], students=emails)
+            synced_courses.append((course_data, await sync_course_isolated(
+                client, course_data, matrix_user_id, room_name_locks, progress)))
+
+    # Let the workers finish the courses already scraped, then stop them
+    async def finish_workers():
+        for _ in workers:
+            course_queue.put_nowait(None)
+        await asyncio.gather(*workers)
+
+    workers = [asyncio.create_task(matrix_worker()) for _ in range(MAX_CONCURRENT_COURSE_SYNCS)]
+    try:
+        try:
+            scrape_result = await run_ilias_scrape(sync_data, progress, course_queue)
+        except asyncio.CancelledError:
+            # A cancelled sync stops right away instead of syncing the courses scraped so far
+            raise
+        except Exception:
+            await finish_workers()
+            raise
+        await finish_workers()
+        if sync_data.removeMissing:
+            await remove_missing_room_members(client, synced_courses, matrix_user_id)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        # The client is handed back only after the workers stopped using it
+        await asyncio.gather(*workers, return_exceptions=True)
+        await matrix_sessions.release(client)
+
+    logging.info(f"ILIAS to Matrix sync completed for user {matrix_user_id}")
+    response = build_sync_response([result for course, result in synced_courses])
+    response["all_email_column_data"] = scrape_result["all_email_column_data"]
+    return response
+
+
 # Playwright-based login and ILIAS course member extraction
 @app.post("/ilias-login-and-get-course-member-info")
-async def ilias_login_and_get_course_member_info(login_data: LoginData):
+async def ilias_login_and_get_course_member_info(login_data: LoginData, timings: bool = False):
+    return JSONResponse(await with_timings(run_ilias_scrape(login_data), timings))
+
+
+# Log in to ILIAS and extract the members of all courses. Progress events are passed
+# to the optional progress callback (used by background jobs).
+async def run_ilias_scrape(login_data: LoginData, progress=None, course_queue=None):
     login_url = (
         'https://login.hs-heilbronn.de/realms/hhn/protocol/openid-connect/auth'
         '?response_mode=form_post&response_type=id_token&redirect_uri=https%3A%2F%2Filias.hs-heilbronn.de%2Fopenidconnect.php'
@@ -176,126 +435,464 @@ async def ilias_login_and_get_course_member_info(login_data: LoginData):
     session_id = str(uuid.uuid4())
     logging.info(f"ILIAS login initiated for user: {login_data.username}")
 
-    # Launch Playwright and configure it to bypass detection
+    # Open a fresh, isolated context on one of the pool's warm browsers. It holds a browser
+    # session slot of the host; when the host is saturated, answer 503 right away.
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, args=["--disable-blink-features=AutomationControlled"])
-            context = await browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
+        async with browser_pool.context() as context:
+            if BLOCK_RESOURCES:
+                await context.route("**/*", route_request)
             page = await context.new_page()
 
-            # Use the following tricks to hide the headless browser
-            await page.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', { get: () => false });
-                Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-                Object.defineProperty(navigator, 'mimeTypes', { get: () => [1, 2, 3] });
-                Object.defineProperty(navigator, 'userAgent', { get: () => navigator.userAgent.replace('HeadlessChrome', 'Chrome') });
-                Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-                Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 4 });
-            """)
-
-            await page.goto(login_url)
-            await page.fill('input[name="username"]', login_data.username)
-            await page.fill('input[name="password"]', login_data.password)
-            await page.click('input[name="login"]')
-
-            # Handle OTP login
-            try:
-                await page.wait_for_selector('a[id="try-another-way"]', timeout=10000)
-                await page.click('a[id="try-another-way"]')
-                await page.wait_for_selector(
-                    "button[name='authenticationExecution'][value='f3ab6699-08c5-422b-a48b-befb53dd758a']",
-                    timeout=10000)
-                await page.click("button[name='authenticationExecution'][value='f3ab6699-08c5-422b-a48b-befb53dd758a']")
-
-                await page.wait_for_selector("input[id='otp']", timeout=10000)
-                await page.fill("input[id='otp']", login_data.loginOtp)
-                await page.click('input[id="kc-login"]')
-            except PlaywrightTimeoutError:
-                logging.error(f"OTP login failed for user {login_data.username}")
-                raise HTTPException(status_code=400, detail="OTP login failed. Please check your credentials and OTP.")
-
-            # Wait for redirection to the dashboard
-            try:
-                await page.wait_for_url("**/ilias.php?baseClass=ilDashboardGUI&cmd=jumpToSelectedItems", timeout=60000)
-                logging.info(f"ILIAS login successful for user {login_data.username}")
-            except PlaywrightTimeoutError:
-                logging.error(f"Failed to log in to ILIAS for user {login_data.username}")
-                raise HTTPException(status_code=400, detail="Failed to log in to ILIAS. Please check your credentials.")
-
-            # Navigate to course list
-            course_list_url = 'https://ilias.hs-heilbronn.de/ilias.php?cmdClass=ilmembershipoverviewgui&cmdNode=jr&baseClass=ilmembershipoverviewgui'
-            await page.goto(course_list_url)
-            await page.wait_for_url(
-                "**/ilias.php?cmdClass=ilmembershipoverviewgui&cmdNode=jr&baseClass=ilmembershipoverviewgui",
-                timeout=60000)
-
-            html_content = await page.content()
-            courses = extract_courses(html_content)
-            logging.info(f"Extracted courses for user {login_data.username}: {[course['name'] for course in courses]}")
-
-            all_email_column_data = []
-            for course in courses:
-                course_html_content, emails = await visit_course_page_and_scrape(page, course)
-
-                # adding demo student emails
-                #emails = emails + demo_students_emails
-
-                all_email_column_data.append({
+            with timed("ilias_login"):
+                await navigate(page, login_url, "login")
+                await page.fill('input[name="username"]', login_data.username)
+                await page.fill('input[name="password"]', login_data.password)
+                await page.click('input[name="login"]')
+
+                # Handle OTP login
+                try:
+                    await page.wait_for_selector('a[id="try-another-way"]', timeout=10000)
+                    await page.click('a[id="try-another-way"]')
+                    await page.wait_for_selector(
+                        "button[name='authenticationExecution'][value='f3ab6699-08c5-422b-a48b-befb53dd758a']",
+                        timeout=10000)
+                    await page.click("button[name='authenticationExecution'][value='f3ab6699-08c5-422b-a48b-befb53dd758a']")
+
+                    await page.wait_for_selector("input[id='otp']", timeout=10000)
+                    await page.fill("input[id='otp']", login_data.loginOtp)
+                    await page.click('input[id="kc-login"]')
+                except PlaywrightTimeoutError:
+                    logging.error(f"OTP login failed for user {login_data.username}")
+                    raise HTTPException(status_code=400, detail="OTP login failed. Please check your credentials and OTP.")
+
+                # Wait for redirection to the dashboard
+                try:
+                    await page.wait_for_url(
+                        "**/ilias.php?baseClass=ilDashboardGUI&cmd=jumpToSelectedItems",
+                        timeout=60000,
+                        wait_until="domcontentloaded")
+                    logging.info(f"ILIAS login successful for user {login_data.username}")
+                    if progress:
+                        progress({"stage": "ilias_logged_in"})
+                except PlaywrightTimeoutError:
+                    logging.error(f"Failed to log in to ILIAS for user {login_data.username}")
+                    raise HTTPException(status_code=400, detail="Failed to log in to ILIAS. Please check your credentials.")
+
+            # Member lists scraped recently are served from the snapshot store in refresh mode
+            ilias_user = login_data.username.strip().lower()
+            snapshots = await snapshot_store.get_fresh(ilias_user) if login_data.refresh else {}
+
+            if FETCH_COURSE_PAGES_OVER_HTTP:
+                # Export the session cookies and hand the browser back to the pool right away
+                session_cookies = await context.cookies()
+            else:
+                courses, scraped_courses = await scrape_all_courses_in_browser(
+                    context, page, progress, course_queue, snapshots)
+
+        # The browser context is closed, so the next login can start while the course pages are fetched
+        if FETCH_COURSE_PAGES_OVER_HTTP:
+            courses, scraped_courses = await scrape_all_courses_over_http(
+                session_cookies, progress=progress, course_queue=course_queue, snapshots=snapshots)
+        logging.info(f"Extracted courses for user {login_data.username}: {[course['name'] for course in courses]}")
+
+        # Remember the freshly scraped member lists for the next refresh
+        freshly_scraped = [
+            (course, emails) for course, emails, error in scraped_courses
+            if error is None and course['refId'] not in snapshots
+        ]
+        changed_ref_ids = await snapshot_store.save_many(ilias_user, freshly_scraped)
+        served_from_snapshot = len(scraped_courses) - len(freshly_scraped) - sum(
+            1 for course, emails, error in scraped_courses if error is not None)
+        logging.info(
+            f"Courses of user {login_data.username}: {len(freshly_scraped)} scraped "
+            f"({len(changed_ref_ids)} changed), {served_from_snapshot} served from snapshots")
+
+        all_email_column_data = []
+        failed_courses = []
+        for course, emails, error in scraped_courses:
+            if error is not None:
+                failed_courses.append({
                     'course_name': course['name'],
                     'course_id': course['refId'],
-                    'students': emails
+                    'error': error
                 })
-                logging.info(f"Extracted students for course '{course['name']}': {emails}")
-
-            # Close browser sessions to free up resources
-            await browser.close()
-            logging.info(f"ILIAS data extraction completed for user {login_data.username}")
-
-            return JSONResponse({"status": "success", "all_email_column_data": all_email_column_data})
-
+                continue
+
+            # adding demo student emails
+            #emails = emails + demo_students_emails
+
+            all_email_column_data.append({
+                'course_name': course['name'],
+                'course_id': course['refId'],
+                'students': emails
+            })
+            logging.info(f"Extracted students for course '{course['name']}': {emails}")
+
+        logging.info(f"ILIAS data extraction completed for user {login_data.username}")
+
+        return {
+            "status": "success",
+            "all_email_column_data": all_email_column_data,
+            "failed_courses": failed_courses,
+            "snapshots": {
+                "scraped": len(freshly_scraped),
+                "changed": len(changed_ref_ids),
+                "served": served_from_snapshot
+            }
+        }
+
+    except BrowserPoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BROWSER_CONTEXT_WAIT)})
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logging.exception(f"An error occurred during ILIAS login for user {login_data.username}: {e}")
         raise HTTPException(status_code=500, detail="An error occurred during ILIAS login.")
 
 
-def extract_courses(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    courses = []
-    course_rows = soup.select('.il-std-item')
-    for course_row in course_rows:
-        img_element = course_row.select_one('img.icon')
-        if img_element and img_element.get('alt') != 'Symbol Gruppe':
-            course_name_element = course_row.select_one('.il-item-title a')
-            if course_name_element:
-                course_name = course_name_element.get_text(strip=True)
-                course_url = course_name_element.get('href')
-                course_ref_id_match = re.search(r'ref_id=(\d+)', course_url)
-                if course_ref_id_match:
-                    course_ref_id = course_ref_id_match.group(1)
-                    courses.append({'name': course_name, 'refId': course_ref_id, 'url': course_url})
-    return courses
+# Browser path: read the course list and scrape all member pages in the logged-in context
+async def scrape_all_courses_in_browser(context, page, progress=None, course_queue=None, snapshots=None):
+    with timed("ilias_course_list"):
+        await navigate(page, COURSE_LIST_URL, "course_list")
+        await page.wait_for_url(
+            "**/ilias.php?cmdClass=ilmembershipoverviewgui&cmdNode=jr&baseClass=ilmembershipoverviewgui",
+            timeout=60000,
+            wait_until="domcontentloaded")
+        html_content = await page.content()
+    courses = await parse_courses(html_content)
+
+    # Scrape all member pages concurrently on extra tabs of the logged-in context
+    report_courses_found(courses, progress)
+    scraped_courses = await scrape_courses(
+        context, page, courses, progress=progress, course_queue=course_queue, snapshots=snapshots)
+    return courses, scraped_courses
+
+
+# Fast path: the course list and member pages are plain server-rendered HTML, so once
+# the Keycloak/OTP login is done they are fetched with a pooled httpx client using the
+# session cookies exported from the browser context.
+async def scrape_all_courses_over_http(
+    session_cookies, max_concurrency=MAX_CONCURRENT_COURSE_REQUESTS, progress=None, course_queue=None, snapshots=None
+):
+    cookies = httpx.Cookies()
+    for cookie in session_cookies:
+        cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+
+    limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+    async with httpx.AsyncClient(
+        cookies=cookies,
+        headers={"User-Agent": BROWSER_USER_AGENT},
+        limits=limits,
+        # Further pages of large members tables queue for a pooled connection without a time limit
+        timeout=httpx.Timeout(HTTP_COURSE_FETCH_TIMEOUT, pool=None),
+        follow_redirects=True
+    ) as http_client:
+        with timed("ilias_course_list"):
+            response = await http_client.get(COURSE_LIST_URL)
+            response.raise_for_status()
+            ensure_ilias_session(COURSE_LIST_URL, response)
+        courses = await parse_courses(response.text)
+        report_courses_found(courses, progress)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        scraped = []
+
+        async def fetch_course(course):
+            async with semaphore:
+                if snapshots and course['refId'] in snapshots:
+                    result = course, snapshots[course['refId']], None
+                else:
+                    result = await fetch_course_members(course)
+                scraped.append(course)
+                publish_course_scraped(result, len(scraped), len(courses), progress, course_queue)
+                return result
+
+        # Fetch pages concurrently over the pooled connections
+        async def fetch_pages(urls):
+            responses = await asyncio.gather(*(http_client.get(url) for url in urls))
+            for url, page_response in zip(urls, responses):
+                page_response.raise_for_status()
+                ensure_ilias_session(url, page_response)
+            return [page_response.text for page_response in responses]
+
+        async def fetch_course_members(course):
+            try:
+                with timed("ilias_course_scrape"):
+                    first_page_html, = await fetch_pages([course_members_url(course)])
+                    return course, await scrape_course_members(course, first_page_html, fetch_pages), None
+            except httpx.HTTPError as e:
+                logging.exception(f"Failed to fetch members of course '{course['name']}': {e}")
+                return course, None, str(e)
+
+        scraped_courses = await asyncio.gather(*(fetch_course(course) for course in courses))
+    return courses, scraped_courses
+
+
+# Scrape the member pages of all courses with a bounded number of tabs in the same
+# authenticated context. Results keep the course order; a failing course is reported
+# with its error instead of aborting the others.
+async def scrape_courses(
+    context, page, courses, max_concurrency=MAX_CONCURRENT_COURSE_PAGES, progress=None, course_queue=None,
+    snapshots=None
+):
+    results = [None] * len(courses)
+    scraped = []
+    queue = asyncio.Queue()
+    for index, course in enumerate(courses):
+        queue.put_nowait((index, course, False))
+
+    def finish(index, result):
+        results[index] = result
+        scraped.append(result[0])
+        publish_course_scraped(result, len(scraped), len(courses), progress, course_queue)
+
+    # Replace a worker's broken tab; False if the context cannot open tabs any more
+    async def reopen_worker_page(worker):
+        try:
+            await worker_pages[worker].close()
+        except PlaywrightError:
+            pass
+        try:
+            worker_pages[worker] = await context.new_page()
+            return True
+        except PlaywrightError as e:
+            logging.error(f"Could not open a new tab for scraping courses: {e}")
+            return False
+
+    async def scrape_worker(worker):
+        while True:
+            try:
+                index, course, retried = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                if snapshots and course['refId'] in snapshots:
+                    finish(index, (course, snapshots[course['refId']], None))
+                    continue
+                with timed("ilias_course_scrape"):
+                    course_html_content, emails = await visit_course_page_and_scrape(worker_pages[worker], course)
+                finish(index, (course, emails, None))
+            except Exception as e:
+                # A crashed or closed tab fails every later course, so move on to a new tab
+                tab_broken = is_tab_broken(worker_pages[worker], e)
+                if tab_broken and not retried:
+                    logging.warning(f"Tab failed while scraping course '{course['name']}', retrying it on a new tab: {e}")
+                    queue.put_nowait((index, course, True))
+                else:
+                    logging.exception(f"Failed to scrape members of course '{course['name']}': {e}")
+                    finish(index, (course, None, str(e)))
+                if tab_broken and not await reopen_worker_page(worker):
+                    return
+
+    # Reuse the logged-in page and open only as many extra tabs as needed
+    courses_to_scrape = [course for course in courses if not snapshots or course['refId'] not in snapshots]
+    worker_pages = [page]
+    try:
+        for _ in range(min(max_concurrency, len(courses_to_scrape)) - 1):
+            worker_pages.append(await context.new_page())
+        await asyncio.gather(*(scrape_worker(worker) for worker in range(len(worker_pages))))
+    finally:
+        for worker_page in worker_pages:
+            if worker_page is not page:
+                await worker_page.close()
+
+    # Courses left over when no worker could open a new tab
+    while not queue.empty():
+        index, course, _ = queue.get_nowait()
+        finish(index, (course, None, "No browser tab left to scrape the course"))
+    return results
+
+
+# A crashed or closed tab fails every later navigation; a timeout leaves it usable
+def is_tab_broken(page, error):
+    return page.is_closed() or (isinstance(error, PlaywrightError) and not isinstance(error, PlaywrightTimeoutError))
+
+
+def report_courses_found(courses, progress):
+    if progress:
+        progress({"stage": "courses_found", "total_courses": len(courses)})
+
+
+# Report a scraped course and, in the streaming pipeline, hand it to the Matrix workers
+def publish_course_scraped(result, done_courses, total_courses, progress, course_queue):
+    if course_queue is not None:
+        course_queue.put_nowait(result)
+    if progress:
+        course, emails, error = result
+        progress({
+            "stage": "course_scraped",
+            "course_name": course['name'],
+            "course_id": course['refId'],
+            "students": len(emails) if emails is not None else 0,
+            "error": error,
+            "done_courses": done_courses,
+            "total_courses": total_courses
+        })
+
+
+# Navigate with the settings of the page type: wait only for the DOM (or the selector
+# marking the page as ready) instead of the full load event
+async def navigate(page, url, page_type):
+    settings = NAVIGATION_SETTINGS[page_type]
+    page_types[page] = page_type
+    await page.goto(url, wait_until=settings["wait_until"])
+    if settings["ready_selector"]:
+        await page.wait_for_selector(settings["ready_selector"], timeout=30000)
+
+
+# Request router of the browser context: abort the resource types the current page
+# type does not need and let everything else through
+async def route_request(route):
+    try:
+        page_type = page_types.get(route.request.frame.page)
+    except PlaywrightError:
+        # Requests without a frame, e.g. from service workers
+        page_type = None
+    if page_type and route.request.resource_type in NAVIGATION_SETTINGS[page_type]["blocked_resources"]:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def course_members_url(course):
+    return f"{ILIAS_BASE_URL}/ilias.php?baseClass=ilrepositorygui&cmdNode=yc:ml:95&cmdClass=ilCourseMembershipGUI&ref_id={course['refId']}"
+
+
+# Without a valid session ILIAS redirects to its login page and answers with status 200,
+# which would parse as a page without courses or members. Fail if the response is not
+# the requested ILIAS page any more.
+def ensure_ilias_session(requested_url, response):
+    requested_class = httpx.URL(requested_url).params.get("cmdClass", "").lower()
+    if response.url.params.get("cmdClass", "").lower() != requested_class:
+        raise RuntimeError(f"ILIAS did not accept the session cookies, got {response.url} instead of the requested page")
+
+
+# URL of one page of a course's members table, optionally with the number of rows per page
+def course_members_page_url(course, paging, offset, rows=None):
+    url = f"{course_members_url(course)}&{paging['nav_parameter']}={paging['order']}:{offset}"
+    if rows:
+        url += f"&{paging['rows_parameter']}={rows}"
+    return url
+
+
+# Collect the members from all pages of a course's members table. A paged table is
+# requested again with the largest page size, which fits nearly every course on one
+# page; pages still missing after that are loaded with fetch_pages, which takes a list
+# of URLs and returns their HTML in the same order.
+async def scrape_course_members(course, first_page_html, fetch_pages):
+    emails, paging = await parse_members_page(first_page_html)
+    if paging is None:
+        return emails
+
+    if paging['limit'] < MEMBER_TABLE_MAX_ROWS:
+        logging.info(f"Members table of course '{course['name']}' is paged, requesting {MEMBER_TABLE_MAX_ROWS} rows per page")
+        first_page_html, = await fetch_pages([course_members_page_url(course, paging, 0, MEMBER_TABLE_MAX_ROWS)])
+        emails, larger_paging = await parse_members_page(first_page_html)
+        if larger_paging is None:
+            return emails
+        paging = larger_paging
+
+    logging.info(f"Fetching {len(paging['offsets'])} more member pages of course '{course['name']}'")
+    pages = await fetch_pages([
+        course_members_page_url(course, paging, offset, paging['limit']) for offset in paging['offsets']
+    ])
+    for page_html in pages:
+        page_emails, _ = await parse_members_page(page_html)
+        emails.extend(page_emails)
+    # A member added or removed between two page loads can move a row onto the next page
+    return list(dict.fromkeys(emails))
 
 
 async def visit_course_page_and_scrape(page, course):
-    dynamic_url = f"https://ilias.hs-heilbronn.de/ilias.php?baseClass=ilrepositorygui&cmdNode=yc:ml:95&cmdClass=ilCourseMembershipGUI&ref_id={course['refId']}"
-    await page.goto(dynamic_url)
-    course_html_content = await page.content()
-    emails = extract_email_column_from_table(course_html_content)
+    # A tab shows one page at a time, so further pages of the table are loaded one after another
+    async def fetch_pages(urls):
+        pages = []
+        for url in urls:
+            await navigate(page, url, "course_members")
+            pages.append(await page.content())
+        return pages
+
+    course_html_content, = await fetch_pages([course_members_url(course)])
+    emails = await scrape_course_members(course, course_html_content, fetch_pages)
     return course_html_content, emails
 
 
-def extract_email_column_from_table(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    table = soup.find('table', {'class': 'table table-striped fullwidth'})
-    email_column_data = []
-    if table:
-        tbody = table.find('tbody')
-        if tbody:
-            for row in tbody.find_all('tr'):
-                columns = row.find_all('td')
-                if len(columns) >= 5:
-                    email_column_data.append(columns[4].text.strip())
-    return email_column_data
+# Run an endpoint and, if the client asked for it, add the time spent per stage to its response
+async def with_timings(work, timings=False):
+    if not timings:
+        return await work
+    with collect_timings() as breakdown:
+        result = await work
+    result["timings"] = format_timings(breakdown)
+    return result
+
+
+# Submit a job and answer with its id right away. Jobs with an ILIAS one-time password
+# are not queued, so the password is used before it expires.
+async def submit_job(kind, work, uses_otp=False):
+    try:
+        job = await job_manager.submit(kind, work, uses_otp)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"status": "accepted", "job_id": job.id}
+
+
+# Background variants of the long-running endpoints: they return a job id immediately and
+# the work continues even if the client disconnects.
+@app.post("/jobs/ilias-login-and-get-course-member-info")
+async def submit_ilias_login_and_get_course_member_info(login_data: LoginData):
+    return await submit_job(
+        "ilias-login-and-get-course-member-info", lambda progress: run_ilias_scrape(login_data, progress), uses_otp=True)
+
+
+@app.post("/jobs/sync-with-matrix")
+async def submit_sync_with_matrix(matrix_login_data: MatrixLoginData):
+    return await submit_job("sync-with-matrix", lambda progress: run_matrix_sync(matrix_login_data, progress))
+
+
+@app.post("/jobs/ilias-sync-with-matrix")
+async def submit_ilias_sync_with_matrix(sync_data: IliasMatrixSyncData):
+    return await submit_job(
+        "ilias-sync-with-matrix", lambda progress: run_ilias_matrix_pipeline(sync_data, progress), uses_otp=True)
+
+
+# Job status including the latest progress event and, once finished, the result
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    state = await job_manager.state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return state
+
+
+# Server-Sent-Events stream with all progress events of a job
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    events = await job_manager.stream_events(job_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    status = await job_manager.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if status in FINISHED_STATES:
+        raise HTTPException(status_code=409, detail=f"Job already {status}.")
+    return {"status": "cancelling", "job_id": job_id}
+
+
+# Prometheus metrics: stage latencies, retries, rate limits, live browsers and in-flight invites
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
 
 # Root route to render index.html
@@ -0,0 +1,85 @@
+# Benchmark of the ILIAS page extraction against the original full-tree parse.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_parsing [--repeat N]
+
+import argparse
+import re
+import time
+from bs4 import BeautifulSoup
+
+from benchmarks.fixtures import load_fixture_pages
+from ilias_parser import extract_courses, extract_email_column_from_table
+
+
+# Reference implementations: full BeautifulSoup tree of the whole page
+def reference_extract_courses(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    courses = []
+    course_rows = soup.select('.il-std-item')
+    for course_row in course_rows:
+        img_element = course_row.select_one('img.icon')
+        if img_element and img_element.get('alt') != 'Symbol Gruppe':
+            course_name_element = course_row.select_one('.il-item-title a')
+            if course_name_element:
+                course_name = course_name_element.get_text(strip=True)
+                course_url = course_name_element.get('href')
+                course_ref_id_match = re.search(r'ref_id=(\d+)', course_url)
+                if course_ref_id_match:
+                    course_ref_id = course_ref_id_match.group(1)
+                    courses.append({'name': course_name, 'refId': course_ref_id, 'url': course_url})
+    return courses
+
+
+def reference_extract_email_column_from_table(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    table = soup.find('table', {'class': 'table table-striped fullwidth'})
+    email_column_data = []
+    if table:
+        tbody = table.find('tbody')
+        if tbody:
+            for row in tbody.find_all('tr'):
+                columns = row.find_all('td')
+                if len(columns) >= 5:
+                    email_column_data.append(columns[4].text.strip())
+    return email_column_data
+
+
+EXTRACTORS = {
+    "courses": (reference_extract_courses, extract_courses),
+    "members": (reference_extract_email_column_from_table, extract_email_column_from_table),
+}
+
+
+def best_time(function, html_content, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(html_content)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ILIAS page extraction")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per page, the best run is reported")
+    args = parser.parse_args()
+
+    print(f"{'page':<22}{'size KB':>10}{'reference ms':>15}{'lxml ms':>14}{'speedup':>10}")
+    for file_name, kind, html_content in load_fixture_pages():
+        reference, extractor = EXTRACTORS[kind]
+
+        # The faster extraction must return exactly what the full parse returns
+        if reference(html_content) != extractor(html_content):
+            raise SystemExit(f"Output mismatch for {file_name}")
+
+        reference_time = best_time(reference, html_content, args.repeat)
+        extractor_time = best_time(extractor, html_content, args.repeat)
+        print(
+            f"{file_name:<22}{len(html_content) / 1024:>10.0f}{reference_time * 1000:>15.1f}"
+            f"{extractor_time * 1000:>14.1f}{reference_time / extractor_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# End-to-end benchmark of the course scraping and the Matrix sync against local
+# stand-ins for ILIAS and the Matrix homeserver, so no real account is needed.
+#
+# The Keycloak/OTP login needs the real ILIAS, so the scraping starts from exported
+# session cookies (the HTTP fast path). Each workload runs in a fresh process with its
+# own working directory, so caches start cold and the peak RSS belongs to that run.
+#
+# Usage (from the repository root):
+#     python -m benchmarks.bench_sync [--workload NAME] [--matrix-latency-ms MS] [--rate-limit-ratio R]
+#     python -m benchmarks.bench_sync --courses 30 --students 500 --existing-rooms 10
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from benchmarks.fake_ilias import FakeIlias
+from benchmarks.fake_matrix import FakeMatrixHomeserver, FAKE_SERVER_NAME
+from ilias_parser import extract_courses
+
+# Synthetic workloads: course list entries (every fifth is a group and skipped) x students
+# per course x course rooms that already exist with all their students joined
+WORKLOADS = {
+    "small": {"courses": 5, "students": 50, "existing_rooms": 0},
+    "semester": {"courses": 30, "students": 200, "existing_rooms": 0},
+    "resync": {"courses": 30, "students": 200, "existing_rooms": 24},
+    "large": {"courses": 30, "students": 1000, "existing_rooms": 0},
+}
+OTHER_ROOMS = 20  # Unrelated rooms of the teacher that the room lookup has to go through
+MATRIX_USER = "teacher"
+
+
+# Create the course rooms of an earlier sync on the fake homeserver
+def seed_existing_rooms(ilias, matrix, existing_rooms):
+    creator = f"@{MATRIX_USER}:{FAKE_SERVER_NAME}"
+    for index in range(OTHER_ROOMS):
+        matrix.add_room(f"Other room {index}", creator)
+    for course in extract_courses(ilias.course_list_page())[:existing_rooms]:
+        user_ids = [f"@student{member}:{FAKE_SERVER_NAME}" for member in ilias.members(course['refId'])]
+        matrix.add_room(course['name'], creator, [user_id for user_id in user_ids if matrix.is_registered(user_id)])
+
+
+# Runs in the benchmark process: scrape all courses, then sync them with Matrix twice
+def run_workload(config):
+    with tempfile.TemporaryDirectory(prefix="hnunisync-bench-") as work_dir:
+        os.chdir(work_dir)
+        os.makedirs("static", exist_ok=True)
+        return _run_workload(config)
+
+
+def _run_workload(config):
+
+    import app
+    import script
+
+    app.COURSE_LIST_URL = app.COURSE_LIST_URL.replace(app.ILIAS_BASE_URL, config["ilias_url"], 1)
+    app.ILIAS_BASE_URL = config["ilias_url"]
+    script.homeserver = config["matrix_url"]
+    rss_after_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async def workload():
+        start = time.perf_counter()
+        courses, scraped_courses = await app.scrape_all_courses_over_http(config["session_cookies"])
+        scrape_seconds = time.perf_counter() - start
+
+        matrix_login_data = app.MatrixLoginData(
+            userId=MATRIX_USER,
+            password="benchmark",
+            courses=[
+                app.Course(course_name=course['name'], course_id=course['refId'], students=emails)
+                for course, emails, error in scraped_courses if error is None
+            ]
+        )
+        start = time.perf_counter()
+        response = await app.run_matrix_sync(matrix_login_data)
+        matrix_seconds = time.perf_counter() - start
+
+        # A second sync right away finds every room and member in place and reuses the session
+        start = time.perf_counter()
+        await app.run_matrix_sync(matrix_login_data)
+        repeat_seconds = time.perf_counter() - start
+        await app.matrix_sessions.stop()
+        return {
+            "scrape_seconds": scrape_seconds,
+            "matrix_seconds": matrix_seconds,
+            "repeat_seconds": repeat_seconds,
+            "courses": len(courses),
+            "failed_courses": len(response["failed_courses"]),
+            "summary": response["summary"],
+        }
+
+    result = asyncio.run(workload())
+    result["rss_after_import_mb"] = rss_after_import / 1024
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_in_fresh_process(config):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_workload, (config,))
+
+
+async def benchmark(name, workload, args):
+    ilias = FakeIlias(workload["courses"], workload["students"], latency=args.ilias_latency_ms / 1000)
+    matrix = FakeMatrixHomeserver(
+        latency=args.matrix_latency_ms / 1000,
+        rate_limit_ratio=args.rate_limit_ratio,
+        registered_ratio=args.registered_ratio,
+    )
+    await ilias.start()
+    await matrix.start()
+    try:
+        seed_existing_rooms(ilias, matrix, workload["existing_rooms"])
+        config = {
+            "ilias_url": ilias.base_url,
+            "matrix_url": matrix.base_url,
+            "session_cookies": ilias.session_cookies(),
+        }
+        start = time.perf_counter()
+        result = await asyncio.to_thread(run_in_fresh_process, config)
+        result["wall_seconds"] = time.perf_counter() - start
+    finally:
+        await matrix.stop()
+        await ilias.stop()
+
+    result.update({
+        "workload": name,
+        **workload,
+        "ilias_requests": dict(ilias.requests),
+        "matrix_requests": dict(matrix.requests),
+        "matrix_rate_limited": matrix.rate_limited,
+    })
+    return result
+
+
+def print_result(result):
+    matrix_requests = result["matrix_requests"]
+    print(
+        f"{result['workload']:<10}{result['courses']:>8}{result['students']:>9}{result['existing_rooms']:>9}"
+        f"{result['scrape_seconds']:>10.2f}{result['matrix_seconds']:>10.2f}{result['repeat_seconds']:>10.2f}"
+        f"{result['wall_seconds']:>9.2f}"
+        f"{sum(result['ilias_requests'].values()):>8}{sum(matrix_requests.values()):>9}"
+        f"{matrix_requests.get('invite', 0):>8}{matrix_requests.get('profile', 0):>9}"
+        f"{result['matrix_rate_limited']:>6}{result['peak_rss_mb']:>9.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scraping and Matrix sync against local fake servers")
+    parser.add_argument("--workload", action="append", choices=sorted(WORKLOADS), help="predefined workload (repeatable)")
+    parser.add_argument("--courses", type=int, help="run a custom workload with this many course list entries")
+    parser.add_argument("--students", type=int, default=200, help="students per course of the custom workload")
+    parser.add_argument("--existing-rooms", type=int, default=0, help="existing course rooms of the custom workload")
+    parser.add_argument("--ilias-latency-ms", type=float, default=50, help="delay of every ILIAS response")
+    parser.add_argument("--matrix-latency-ms", type=float, default=20, help="delay of every Matrix response")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of Matrix requests answered with 429")
+    parser.add_argument("--registered-ratio", type=float, default=0.9, help="share of students with a Matrix account")
+    parser.add_argument("--json", action="store_true", help="print the full results as JSON")
+    args = parser.parse_args()
+
+    if args.courses:
+        workloads = {"custom": {"courses": args.courses, "students": args.students, "existing_rooms": args.existing_rooms}}
+    else:
+        workloads = {name: WORKLOADS[name] for name in (args.workload or WORKLOADS)}
+
+    results = []
+    if not args.json:
+        print(
+            f"{'workload':<10}{'courses':>8}{'students':>9}{'existing':>9}{'scrape s':>10}{'matrix s':>10}{'repeat s':>10}{'wall s':>9}"
+            f"{'ILIAS':>8}{'Matrix':>9}{'invites':>8}{'profiles':>9}{'429s':>6}{'RSS MB':>9}"
+        )
+    for name, workload in workloads.items():
+        result = asyncio.run(benchmark(name, workload, args))
+        results.append(result)
+        if not args.json:
+            print_result(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
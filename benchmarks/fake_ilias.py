@@ -0,0 +1,103 @@
+# Local stand-in for ilias.hs-heilbronn.de serving the synthetic fixture pages: the
+# membership overview and the members table of every course, paged like ILIAS tables.
+# Requests without the session cookie are redirected to a login page served with status
+# 200, like ILIAS does when the session is not accepted.
+
+import asyncio
+from collections import Counter
+from aiohttp import web
+
+from benchmarks.fixtures import course_list_page, course_members_page
+
+SESSION_COOKIE = "PHPSESSID"
+SESSION_ID = "benchmark-session"
+FIRST_REF_ID = 100000  # ref_id of the first course on the fixture course list
+TABLE_ROWS = 50  # Rows per page of the members table unless the request asks for more
+TABLE_MAX_ROWS = 800  # Largest rows per page ILIAS accepts
+TABLE_ORDER = "login:asc"
+
+
+class FakeIlias:
+    def __init__(self, course_count, students_per_course, latency=0.0, table_rows=TABLE_ROWS):
+        self.course_count = course_count
+        self.students_per_course = students_per_course
+        self.latency = latency
+        self.table_rows = table_rows
+        self.requests = Counter()
+        self._pages = {}
+        self._runner = None
+        self.base_url = None
+
+    def course_list_page(self):
+        if "course_list" not in self._pages:
+            self._pages["course_list"] = course_list_page(self.course_count)
+        return self._pages["course_list"]
+
+    # Member numbers of a course; courses share half of their students with the next course
+    def members(self, ref_id):
+        first_member = (int(ref_id) - FIRST_REF_ID) * self.students_per_course // 2
+        return range(first_member, first_member + self.students_per_course)
+
+    # One page of the members table with ILIAS-style paging links: the first, last and
+    # neighbouring pages only, so the scraper has to work out the pages in between
+    def members_page(self, ref_id, offset=0, rows=None):
+        rows = min(rows or self.table_rows, TABLE_MAX_ROWS)
+        key = (ref_id, offset, rows)
+        if key not in self._pages:
+            members = self.members(ref_id)
+            page_offsets = range(0, len(members), rows)
+            current = offset // rows
+            links = []
+            for page_number, page_offset in enumerate(page_offsets):
+                if page_number != current and (page_number in (0, len(page_offsets) - 1) or abs(page_number - current) <= 2):
+                    links.append(
+                        f'<a href="ilias.php?baseClass=ilrepositorygui&amp;ref_id={ref_id}'
+                        f'&amp;crs_{ref_id}_table_nav={TABLE_ORDER}:{page_offset}">{page_number + 1}</a>')
+            page_members = members[offset:offset + rows]
+            self._pages[key] = course_members_page(
+                len(page_members), first_member=page_members.start if page_members else 0, table_nav=" ".join(links))
+        return self._pages[key]
+
+    async def _handle(self, request):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.cookies.get(SESSION_COOKIE) != SESSION_ID:
+            self.requests["unauthorized"] += 1
+            raise web.HTTPFound("/login.php?cmd=force_login")
+
+        if request.query.get("cmdClass") == "ilmembershipoverviewgui":
+            self.requests["course_list"] += 1
+            return web.Response(text=self.course_list_page(), content_type="text/html")
+
+        ref_id = request.query.get("ref_id", "0")
+        if ref_id.isdigit() and 0 <= int(ref_id) - FIRST_REF_ID < self.course_count:
+            self.requests["course_members"] += 1
+            offset = int(request.query.get(f"crs_{ref_id}_table_nav", f"{TABLE_ORDER}:0").rsplit(":", 1)[1])
+            rows = int(request.query.get(f"crs_{ref_id}_trows", "0")) or None
+            return web.Response(text=self.members_page(ref_id, offset, rows), content_type="text/html")
+        self.requests["not_found"] += 1
+        return web.Response(status=404, text="Unknown course")
+
+    async def _login_page(self, request):
+        return web.Response(text="<html><body><form id=\"login_form\"></form></body></html>", content_type="text/html")
+
+    # Session cookies in the format exported by a Playwright browser context
+    def session_cookies(self):
+        return [{"name": SESSION_COOKIE, "value": SESSION_ID, "domain": "127.0.0.1", "path": "/"}]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/ilias.php", self._handle)
+        app.router.add_get("/login.php", self._login_page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
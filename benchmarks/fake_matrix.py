@@ -0,0 +1,184 @@
+# Local stand-in for the Matrix homeserver implementing the client-server API calls
+# the sync uses: login/logout, whoami, createRoom, invite, kick, joined_rooms, room state and
+# profile lookups. Every response can be delayed, and a share of the requests is
+# answered with 429 M_LIMIT_EXCEEDED to exercise the rate limiting.
+
+import asyncio
+import random
+import zlib
+from collections import Counter
+from aiohttp import web
+
+API_PREFIX = "/_matrix/client/v3"
+FAKE_SERVER_NAME = "unifyhn.de"  # Same domain the app builds user IDs with
+
+
+class FakeMatrixHomeserver:
+    def __init__(self, latency=0.0, rate_limit_ratio=0.0, retry_after_ms=200, registered_ratio=0.9, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after_ms = retry_after_ms
+        self.registered_ratio = registered_ratio
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.rooms = {}  # room_id -> {"name": name, "members": {user_id: membership}, "power_levels": {user_id: level}}
+        self._random = random.Random(seed)
+        self._room_counter = 0
+        self._tokens = {}  # access_token -> user_id
+        self._runner = None
+        self.base_url = None
+
+    # A fixed share of all user IDs has an account; the choice is stable between runs
+    def is_registered(self, user_id):
+        return zlib.crc32(user_id.encode("utf-8")) % 1000 < self.registered_ratio * 1000
+
+    # Add a room the user already has, e.g. from an earlier sync
+    def add_room(self, name, creator, members=()):
+        self._room_counter += 1
+        room_id = f"!room{self._room_counter}:{FAKE_SERVER_NAME}"
+        self.rooms[room_id] = {"name": name, "members": {creator: "join"}, "power_levels": {creator: 100}}
+        for user_id in members:
+            self.rooms[room_id]["members"][user_id] = "join"
+        return room_id
+
+    def _error(self, status, errcode, message, **extra):
+        return web.json_response({"errcode": errcode, "error": message, **extra}, status=status)
+
+    def _user(self, request):
+        token = request.query.get("access_token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        return self._tokens.get(token)
+
+    # Latency, 429 injection, authentication and request counting shared by all endpoints
+    def _endpoint(self, name, handler, authenticated=True):
+        async def handle(request):
+            self.requests[name] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+                self.rate_limited += 1
+                return self._error(429, "M_LIMIT_EXCEEDED", "Too many requests", retry_after_ms=self.retry_after_ms)
+            user_id = None
+            if authenticated:
+                user_id = self._user(request)
+                if user_id is None:
+                    return self._error(401, "M_UNKNOWN_TOKEN", "Invalid access token")
+            return await handler(request, user_id)
+        return handle
+
+    async def _login(self, request, _):
+        body = await request.json()
+        localpart = body.get("identifier", {}).get("user") or body.get("user")
+        user_id = localpart if localpart.startswith("@") else f"@{localpart}:{FAKE_SERVER_NAME}"
+        token = f"token_{len(self._tokens)}"
+        self._tokens[token] = user_id
+        return web.json_response({"user_id": user_id, "access_token": token, "device_id": "BENCHMARK"})
+
+    async def _logout(self, request, _):
+        self._tokens.pop(request.query.get("access_token"), None)
+        return web.json_response({})
+
+    async def _whoami(self, request, user_id):
+        return web.json_response({"user_id": user_id, "device_id": "BENCHMARK"})
+
+    async def _joined_rooms(self, request, user_id):
+        rooms = [room_id for room_id, room in self.rooms.items() if room["members"].get(user_id) == "join"]
+        return web.json_response({"joined_rooms": rooms})
+
+    async def _create_room(self, request, user_id):
+        body = await request.json()
+        invites = body.get("invite", [])
+        unknown = [invitee for invitee in invites if not self.is_registered(invitee)]
+        if unknown:
+            return self._error(404, "M_NOT_FOUND", f"Unknown user {unknown[0]}")
+        room_id = self.add_room(body.get("name"), user_id)
+        for invitee in invites:
+            self.rooms[room_id]["members"][invitee] = "invite"
+        return web.json_response({"room_id": room_id})
+
+    async def _room_state(self, request, user_id):
+        room = self.rooms.get(request.match_info["room_id"])
+        if room is None or room["members"].get(user_id) != "join":
+            return self._error(403, "M_FORBIDDEN", "Not in room")
+        events = [{
+            "type": "m.room.member", "state_key": member, "content": {"membership": membership},
+            "event_id": f"$member_{index}", "sender": member, "origin_server_ts": 0
+        } for index, (member, membership) in enumerate(room["members"].items())]
+        events.append({
+            "type": "m.room.power_levels", "state_key": "", "content": {"users": room["power_levels"], "users_default": 0},
+            "event_id": "$power_levels", "sender": user_id, "origin_server_ts": 0
+        })
+        if room["name"]:
+            events.append({
+                "type": "m.room.name", "state_key": "", "content": {"name": room["name"]},
+                "event_id": "$name", "sender": user_id, "origin_server_ts": 0
+            })
+        return web.json_response(events)
+
+    async def _room_state_event(self, request, user_id):
+        room = self.rooms.get(request.match_info["room_id"])
+        if room is None or room["members"].get(user_id) != "join":
+            return self._error(403, "M_FORBIDDEN", "Not in room")
+        if request.match_info["event_type"] != "m.room.name" or not room["name"]:
+            return self._error(404, "M_NOT_FOUND", "Event not found")
+        return web.json_response({"name": room["name"]})
+
+    async def _invite(self, request, user_id):
+        room = self.rooms.get(request.match_info["room_id"])
+        invitee = (await request.json()).get("user_id")
+        if room is None or room["members"].get(user_id) != "join":
+            return self._error(403, "M_FORBIDDEN", "Not in room")
+        if not self.is_registered(invitee):
+            return self._error(404, "M_NOT_FOUND", f"Unknown user {invitee}")
+        if room["members"].get(invitee) == "join":
+            return self._error(403, "M_FORBIDDEN", f"{invitee} is already in the room")
+        room["members"][invitee] = "invite"
+        return web.json_response({})
+
+    async def _kick(self, request, user_id):
+        room = self.rooms.get(request.match_info["room_id"])
+        if room is None or room["members"].get(user_id) != "join":
+            return self._error(403, "M_FORBIDDEN", "Not in room")
+        room["members"][(await request.json()).get("user_id")] = "leave"
+        return web.json_response({})
+
+    async def _profile(self, request, _):
+        profile_user = request.match_info["user_id"]
+        if not self.is_registered(profile_user):
+            return self._error(404, "M_NOT_FOUND", "Profile was not found")
+        return web.json_response({"displayname": profile_user.split(":")[0].lstrip("@")})
+
+    async def _unknown(self, request):
+        self.requests[f"unhandled {request.method} {request.path}"] += 1
+        return self._error(404, "M_UNRECOGNIZED", "Unrecognized request")
+
+    async def start(self):
+        app = web.Application()
+        routes = [
+            ("POST", "/login", "login", self._login, False),
+            ("POST", "/logout", "logout", self._logout, True),
+            ("GET", "/account/whoami", "whoami", self._whoami, True),
+            ("GET", "/joined_rooms", "joined_rooms", self._joined_rooms, True),
+            ("POST", "/createRoom", "createRoom", self._create_room, True),
+            ("GET", "/rooms/{room_id}/state", "state", self._room_state, True),
+            ("GET", "/rooms/{room_id}/state/{event_type}", "state_event", self._room_state_event, True),
+            ("GET", "/rooms/{room_id}/state/{event_type}/{state_key:.*}", "state_event", self._room_state_event, True),
+            ("POST", "/rooms/{room_id}/invite", "invite", self._invite, True),
+            ("POST", "/rooms/{room_id}/kick", "kick", self._kick, True),
+            ("GET", "/profile/{user_id}", "profile", self._profile, False),
+        ]
+        for method, path, name, handler, authenticated in routes:
+            app.router.add_route(method, API_PREFIX + path, self._endpoint(name, handler, authenticated))
+        app.router.add_route("*", "/{tail:.*}", self._unknown)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
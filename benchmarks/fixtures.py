@@ -0,0 +1,136 @@
+import os
+
+# Directory where fixture pages are saved. Real pages saved from ILIAS can be dropped
+# here as well (they contain personal data, so the directory is not committed).
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+MEMBER_COUNTS = [10, 100, 500, 2000]
+COURSE_COUNTS = [5, 30]
+
+# Page chrome similar to ILIAS: header, main menu, scripts and footer that the
+# scrapers never read but every full parse has to build.
+PAGE_HEADER = """<!DOCTYPE html>
+<html lang="de">
+<head>
+<meta charset="utf-8">
+<title>ILIAS HHN</title>
+{stylesheets}
+{scripts}
+</head>
+<body>
+<div class="il-layout-page">
+<header class="il-header"><div class="header-inner"><a class="il-logo" href="#"><img src="logo.svg" alt="ILIAS"></a></div></header>
+<nav class="il-maincontrols-mainbar">
+<ul class="il-mainbar-entries">
+{menu}
+</ul>
+</nav>
+<main class="il-layout-page-content">
+<div id="mainspacekeeper" class="container-fluid">
+"""
+
+PAGE_FOOTER = """
+</div>
+</main>
+<footer class="il-footer"><div class="il-footer-content">
+{footer_links}
+</div></footer>
+</div>
+{scripts}
+</body>
+</html>
+"""
+
+
+def _page_header():
+    stylesheets = "\n".join(f'<link rel="stylesheet" href="./templates/default/delos_{i}.css">' for i in range(12))
+    scripts = "\n".join(f'<script src="./node_modules/lib_{i}.js"></script>' for i in range(25))
+    menu = "\n".join(
+        f'<li><button class="btn btn-bulky" data-action="menu_{i}"><img class="icon" src="icon_{i}.svg" alt="Menu {i}">'
+        f'<span class="bulky-label">Eintrag {i}</span></button>'
+        f'<ul class="il-maincontrols-slate">' + "".join(f'<li><a href="goto.php?target=item_{i}_{j}">Item {j}</a></li>' for j in range(8)) +
+        '</ul></li>'
+        for i in range(20)
+    )
+    return PAGE_HEADER.format(stylesheets=stylesheets, scripts=scripts, menu=menu)
+
+
+def _page_footer():
+    footer_links = "\n".join(f'<a href="footer_{i}.html">Link {i}</a>' for i in range(15))
+    scripts = "\n".join(
+        f'<script>il.Util.addOnLoad(function() {{ il.UI.init_{i}({{"id": "il_ui_fw_{i}", "options": [1, 2, 3]}}); }});</script>'
+        for i in range(40)
+    )
+    return PAGE_FOOTER.format(footer_links=footer_links, scripts=scripts)
+
+
+# Membership overview with the given number of courses (every fifth item is a group)
+def course_list_page(course_count):
+    items = []
+    for i in range(course_count):
+        alt = "Symbol Gruppe" if i % 5 == 4 else "Symbol Kurs"
+        items.append(
+            '<div class="il-std-item-container"><div class="il-std-item">'
+            f'<div class="il-item-icon"><img class="icon small" src="icon_crs.svg" alt="{alt}"></div>'
+            '<div class="il-item-title">'
+            f'<a href="ilias.php?baseClass=ilrepositorygui&amp;ref_id={100000 + i}&amp;cmd=view">Kurs {i} - Wintersemester</a>'
+            '</div>'
+            f'<div class="il-item-description">Beschreibung von Kurs {i}</div>'
+            '<div class="il-item-properties"><div class="il-item-property-name">Status</div>'
+            '<div class="il-item-property-value">Online</div></div>'
+            '</div></div>'
+        )
+    return _page_header() + '<div class="il-item-group">' + "\n".join(items) + '</div>' + _page_footer()
+
+
+# Course members page with the given number of members in the members table, numbered
+# from first_member on (so that courses can share part of their students). table_nav is
+# the HTML of the table's paging links, if any.
+def course_members_page(member_count, first_member=0, table_nav=""):
+    rows = []
+    for i in range(first_member, first_member + member_count):
+        rows.append(
+            '<tr>'
+            f'<td><input type="checkbox" name="participants[]" value="{i}"></td>'
+            f'<td><img class="ilUserXXSmall" src="avatar_{i}.jpg" alt="Avatar"></td>'
+            f'<td>Nachname{i}, Vorname{i}</td>'
+            f'<td>user{i}</td>'
+            f'<td> student{i}@stud.hs-heilbronn.de </td>'
+            '<td>Mitglied</td>'
+            '<td><div class="dropdown"><button class="btn btn-default dropdown-toggle">Aktionen</button>'
+            '<ul class="dropdown-menu"><li><a href="#">Bearbeiten</a></li><li><a href="#">Mail</a></li></ul></div></td>'
+            '</tr>'
+        )
+    table = (
+        f'<form class="ilTableOuter"><div class="ilTableNav">Mitglieder {table_nav}</div>'
+        '<table class="table table-striped fullwidth"><thead><tr>'
+        '<th></th><th>Bild</th><th>Name</th><th>Benutzername</th><th>E-Mail</th><th>Rolle</th><th>Aktionen</th>'
+        '</tr></thead><tbody>' + "\n".join(rows) + '</tbody></table></form>'
+    )
+    return _page_header() + table + _page_footer()
+
+
+# Load the saved fixture pages, writing the synthetic ones first if they are missing.
+# Returns a list of (file name, kind, html) with kind being "courses" or "members".
+def load_fixture_pages():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for count in COURSE_COUNTS:
+        _write_if_missing(f"courses_{count}.html", lambda: course_list_page(count))
+    for count in MEMBER_COUNTS:
+        _write_if_missing(f"members_{count}.html", lambda: course_members_page(count))
+
+    pages = []
+    for file_name in sorted(os.listdir(FIXTURES_DIR)):
+        if not file_name.endswith(".html"):
+            continue
+        kind = "courses" if file_name.startswith("courses") else "members"
+        with open(os.path.join(FIXTURES_DIR, file_name), encoding="utf-8") as fixture_file:
+            pages.append((file_name, kind, fixture_file.read()))
+    return pages
+
+
+def _write_if_missing(file_name, build_page):
+    path = os.path.join(FIXTURES_DIR, file_name)
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as fixture_file:
+            fixture_file.write(build_page())
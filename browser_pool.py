@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright, Error as PlaywrightError
+
+from admission import BrowserAdmission, WEB_WORKERS
+from metrics import timed, LIVE_BROWSERS, ADMISSION_REJECTED
+
+# Set limits for the shared Chromium pool
+BROWSER_POOL_SIZE = 2  # Number of pre-launched browsers kept warm per process
+BROWSER_MAX_USES = 50  # Recycle a browser after this many contexts to bound memory growth
+BROWSER_MAX_CONTEXTS = 4  # Contexts (logins) open on one browser at the same time
+BROWSER_CONTEXT_WAIT = 30  # Seconds a request waits for a free context before it is rejected
+BROWSER_QUEUE_SIZE = 20  # Requests per process waiting for a context before new ones are rejected at once
+BROWSER_LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled"]
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+
+# Use the following tricks to hide the headless browser
+STEALTH_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => false });
+    Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
+    Object.defineProperty(navigator, 'mimeTypes', { get: () => [1, 2, 3] });
+    Object.defineProperty(navigator, 'userAgent', { get: () => navigator.userAgent.replace('HeadlessChrome', 'Chrome') });
+    Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
+    Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 4 });
+"""
+
+
+class BrowserPoolBusyError(Exception):
+    pass
+
+
+# Process-wide pool of pre-launched Chromium browsers shared by all requests. Each request
+# gets a fresh, isolated BrowserContext on one of them, handed out round-robin, so a login
+# costs a context creation instead of a browser cold start. A browser holds at most
+# max_contexts contexts at once; when all are taken, requests wait in arrival order for up
+# to max_wait seconds, and beyond max_waiting waiting requests new ones are rejected at once.
+# Once a request has a browser, it waits for a host-wide session slot from the admission
+# control, which it holds until its context is closed.
+# Crashed and worn-out browsers stop taking contexts and are relaunched once their last
+# context is closed.
+class BrowserPool:
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        max_uses: int = BROWSER_MAX_USES,
+        max_contexts: int = BROWSER_MAX_CONTEXTS,
+        max_wait: float = BROWSER_CONTEXT_WAIT,
+        max_waiting: int = BROWSER_QUEUE_SIZE,
+        admission: BrowserAdmission = None,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_contexts = max_contexts
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.admission = admission
+        self._playwright = None
+        self._browsers = []  # Browser of every slot, None while it could not be launched
+        self._open = []  # Open contexts per slot
+        self._uses = []  # Contexts created per slot since its browser was launched
+        self._retiring = set()  # Slots that take no new contexts until their browser is replaced
+        self._replacing = {}  # Slot -> task relaunching its browser
+        self._next = 0
+        self._waiters = deque()
+        self._condition = None
+
+    # Start the Playwright driver and launch all browsers of the pool
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self._condition = asyncio.Condition()
+        self._browsers = [await self._launch() for _ in range(self.size)]
+        self._open = [0] * self.size
+        self._uses = [0] * self.size
+        logging.info(f"Browser pool started with {self.size} browsers")
+
+    async def _launch(self):
+        with timed("browser_launch"):
+            browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_LAUNCH_ARGS)
+        LIVE_BROWSERS.inc()
+        browser.on("disconnected", lambda _: LIVE_BROWSERS.dec())
+        return browser
+
+    # Health check: a browser is usable as long as its connection is alive
+    def _is_healthy(self, browser):
+        return browser is not None and browser.is_connected()
+
+    # Replace a crashed or worn-out browser with a freshly launched one
+    async def _recycle(self, index):
+        browser = self._browsers[index]
+        if browser is not None:
+            try:
+                await browser.close()
+            except PlaywrightError as e:
+                logging.warning(f"Error closing browser during recycle: {e}")
+        try:
+            browser = await self._launch()
+        except PlaywrightError as e:
+            # Keep the slot retired; the next checkout retries the launch
+            logging.exception(f"Failed to relaunch browser: {e}")
+            browser = None
+        async with self._condition:
+            self._browsers[index] = browser
+            self._uses[index] = 0
+            if browser is not None:
+                self._retiring.discard(index)
+            del self._replacing[index]
+            self._condition.notify_all()
+
+    # Relaunch a retired browser once none of its contexts is open any more
+    def _recycle_if_idle(self, index):
+        if index in self._retiring and self._open[index] == 0 and index not in self._replacing:
+            logging.info(f"Recycling browser after {self._uses[index]} uses")
+            self._replacing[index] = asyncio.create_task(self._recycle(index))
+
+    # Next browser in round-robin order that can take another context, or None
+    def _pick(self):
+        for offset in range(self.size):
+            index = (self._next + offset) % self.size
+            if index not in self._retiring and not self._is_healthy(self._browsers[index]):
+                logging.warning("Browser in pool is not healthy. Relaunching...")
+                self._retiring.add(index)
+            if index in self._retiring:
+                self._recycle_if_idle(index)
+                continue
+            if self._open[index] < self.max_contexts:
+                self._next = (index + 1) % self.size
+                return index
+        return None
+
+    async def _checkout(self):
+        deadline = time.monotonic() + self.max_wait
+        async with self._condition:
+            if len(self._waiters) >= self.max_waiting:
+                ADMISSION_REJECTED.labels("browser_queue_full").inc()
+                logging.warning(f"Rejecting browser context: {len(self._waiters)} requests are waiting already")
+                raise BrowserPoolBusyError("Too many ILIAS logins in progress. Please try again later.")
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                # Only the longest waiting request gets the next free context
+                while self._waiters[0] is not ticket or (index := self._pick()) is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        ADMISSION_REJECTED.labels("browser_timeout").inc()
+                        logging.warning(f"No browser context free after waiting {self.max_wait} seconds")
+                        raise BrowserPoolBusyError("All browsers are busy with other ILIAS logins. Please try again later.")
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiters.remove(ticket)
+                # The next request in line may be able to take a context now
+                self._condition.notify_all()
+            self._open[index] += 1
+            self._uses[index] += 1
+            if self._uses[index] >= self.max_uses:
+                # Finish the contexts already handed out, then relaunch
+                self._retiring.add(index)
+            return index
+
+    async def _checkin(self, index):
+        async with self._condition:
+            self._open[index] -= 1
+            self._recycle_if_idle(index)
+            self._condition.notify_all()
+
+    # Yield a fresh BrowserContext on one of the pool's browsers
+    @asynccontextmanager
+    async def context(self):
+        if self._condition is None:
+            raise RuntimeError("Browser pool has not been started.")
+
+        index = await self._checkout()
+        slot = None
+        context = None
+        try:
+            if self.admission is not None:
+                with timed("admission_wait"):
+                    slot = await self.admission.acquire()
+            with timed("browser_new_context"):
+                context = await self._browsers[index].new_context(user_agent=BROWSER_USER_AGENT)
+            await context.add_init_script(STEALTH_INIT_SCRIPT)
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except PlaywrightError as e:
+                    logging.warning(f"Error closing browser context: {e}")
+            if slot is not None:
+                slot.release()
+            await self._checkin(index)
+
+    # Close all browsers and stop the Playwright driver
+    async def stop(self):
+        for task in self._replacing.values():
+            task.cancel()
+        await asyncio.gather(*self._replacing.values(), return_exceptions=True)
+        self._replacing.clear()
+        for browser in self._browsers:
+            if browser is not None:
+                try:
+                    await browser.close()
+                except PlaywrightError as e:
+                    logging.warning(f"Error closing browser during shutdown: {e}")
+        self._browsers = []
+        self._retiring.clear()
+        self._condition = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        logging.info("Browser pool stopped")
+
+
+browser_pool = BrowserPool(admission=BrowserAdmission(warm_browsers=BROWSER_POOL_SIZE * WEB_WORKERS))
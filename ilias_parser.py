@@ -0,0 +1,128 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import lxml.html
+
+from metrics import timed
+
+# Set limits for HTML parsing
+PARSER_WORKERS = 4  # Worker threads used to parse ILIAS pages off the event loop (lxml releases the GIL)
+
+# XPath expressions matching the CSS selectors the scrapers were written against
+COURSE_ROWS_XPATH = "//*[contains(concat(' ', normalize-space(@class), ' '), ' il-std-item ')]"
+COURSE_ICON_XPATH = ".//img[contains(concat(' ', normalize-space(@class), ' '), ' icon ')]"
+COURSE_TITLE_LINK_XPATH = ".//*[contains(concat(' ', normalize-space(@class), ' '), ' il-item-title ')]//a"
+MEMBER_TABLE_XPATH = "//table[normalize-space(@class)='table table-striped fullwidth']"
+EMAIL_COLUMN_HEADERS = ("e-mail", "email", "e-mail-adresse")  # Lower-case header names of the email column
+EMAIL_COLUMN_FALLBACK_INDEX = 4  # Email column of the members table when no header matches
+TABLE_NAV_SUFFIX = "_table_nav"  # ILIAS table paging parameter: <prefix>_table_nav=<order field>:<direction>:<offset>
+TABLE_ROWS_SUFFIX = "_trows"  # ILIAS table parameter selecting the rows per page: <prefix>_trows=<rows>
+
+_parser_executor = ThreadPoolExecutor(max_workers=PARSER_WORKERS, thread_name_prefix="ilias-parser")
+
+
+def _parse_document(html_content):
+    if not html_content or not html_content.strip():
+        return None
+    return lxml.html.document_fromstring(html_content)
+
+
+# Extract the courses (name, ref_id and url) from the ILIAS membership overview
+def extract_courses(html_content):
+    document = _parse_document(html_content)
+    courses = []
+    if document is None:
+        return courses
+    for course_row in document.xpath(COURSE_ROWS_XPATH):
+        img_elements = course_row.xpath(COURSE_ICON_XPATH)
+        if img_elements and img_elements[0].get('alt') != 'Symbol Gruppe':
+            course_name_elements = course_row.xpath(COURSE_TITLE_LINK_XPATH)
+            if course_name_elements:
+                course_name_element = course_name_elements[0]
+                course_name = "".join(text.strip() for text in course_name_element.itertext())
+                course_url = course_name_element.get('href')
+                course_ref_id_match = re.search(r'ref_id=(\d+)', course_url)
+                if course_ref_id_match:
+                    course_ref_id = course_ref_id_match.group(1)
+                    courses.append({'name': course_name, 'refId': course_ref_id, 'url': course_url})
+    return courses
+
+
+# Position of the email column, found by its header name
+def _email_column_index(table):
+    index = 0
+    for header in table.xpath('.//thead//th'):
+        if "".join(header.itertext()).strip().lower() in EMAIL_COLUMN_HEADERS:
+            return index
+        colspan = header.get('colspan', '1')
+        index += int(colspan) if colspan.isdigit() else 1
+    return EMAIL_COLUMN_FALLBACK_INDEX
+
+
+# Paging of the members table as found in its navigation links: the parameter names, the
+# sort order, the page size and the offsets of all further pages. None if there is only one page.
+def _table_paging(document):
+    nav_parameter = None
+    order = None
+    offsets = set()
+    for href in document.xpath('//a/@href'):
+        for name, value in parse_qsl(urlsplit(href).query):
+            if not name.endswith(TABLE_NAV_SUFFIX):
+                continue
+            parts = value.split(":")
+            # Column sort links in the table header point to offset 0; only the linkbar pages
+            if len(parts) == 3 and parts[2].isdigit() and int(parts[2]) > 0:
+                nav_parameter = name
+                order = f"{parts[0]}:{parts[1]}"
+                offsets.add(int(parts[2]))
+    if not offsets:
+        return None
+
+    # The linkbar may skip pages, so all offsets up to the last page are derived from the page size
+    limit = min(offsets)
+    return {
+        "nav_parameter": nav_parameter,
+        "rows_parameter": nav_parameter[:-len(TABLE_NAV_SUFFIX)] + TABLE_ROWS_SUFFIX,
+        "order": order,
+        "limit": limit,
+        "offsets": list(range(limit, max(offsets) + 1, limit)),
+    }
+
+
+# Extract the email column and the paging of the members table of an ILIAS course page
+def extract_members_page(html_content):
+    document = _parse_document(html_content)
+    email_column_data = []
+    if document is None:
+        return email_column_data, None
+    tables = document.xpath(MEMBER_TABLE_XPATH)
+    if tables:
+        email_index = _email_column_index(tables[0])
+        tbodies = tables[0].xpath('.//tbody')
+        if tbodies:
+            for row in tbodies[0].xpath('.//tr'):
+                columns = row.xpath('.//td')
+                if len(columns) > email_index:
+                    email_column_data.append("".join(columns[email_index].itertext()).strip())
+    return email_column_data, _table_paging(document)
+
+
+# Extract the email column from the members table of an ILIAS course page
+def extract_email_column_from_table(html_content):
+    return extract_members_page(html_content)[0]
+
+
+# Parse the membership overview in the worker pool so large pages don't block the event loop
+async def parse_courses(html_content):
+    loop = asyncio.get_running_loop()
+    with timed("parse_courses"):
+        return await loop.run_in_executor(_parser_executor, extract_courses, html_content)
+
+
+# Parse a course members page in the worker pool so large pages don't block the event loop.
+# Returns the emails on the page and the paging of the members table (None for a single page).
+async def parse_members_page(html_content):
+    loop = asyncio.get_running_loop()
+    with timed("parse_members"):
+        return await loop.run_in_executor(_parser_executor, extract_members_page, html_content)
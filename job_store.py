@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from sqlite_store import SqliteStore
+
+
+# Whether the worker process that owns a job is still running
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Persistent state and progress events of the background jobs, so that every Gunicorn
+# worker can report on and stream the jobs of the others. Cancelling a job of another
+# worker only sets a flag here, which the owning worker picks up.
+class JobStore(SqliteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, owner_pid INTEGER NOT NULL, "
+        "created_at REAL NOT NULL, started_at REAL, finished_at REAL, progress TEXT, "
+        "event_count INTEGER NOT NULL, result TEXT, error TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0);"
+        "CREATE TABLE IF NOT EXISTS job_events ("
+        "job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (job_id, seq));"
+    )
+
+    def _save_many(self, jobs):
+        connection = self._connect()
+        try:
+            for state, new_events in jobs:
+                # The cancel flag belongs to the other workers and is left alone
+                connection.execute(
+                    "INSERT INTO jobs (job_id, kind, status, owner_pid, created_at, started_at, finished_at, "
+                    "progress, event_count, result, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (job_id) DO UPDATE SET status = excluded.status, started_at = excluded.started_at, "
+                    "finished_at = excluded.finished_at, progress = excluded.progress, "
+                    "event_count = excluded.event_count, result = excluded.result, error = excluded.error",
+                    (
+                        state["job_id"], state["kind"], state["status"], os.getpid(), state["created_at"],
+                        state["started_at"], state["finished_at"], json.dumps(state["progress"]),
+                        state["event_count"], json.dumps(state["result"]), state["error"],
+                    ),
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                    [(state["job_id"], seq, json.dumps(event)) for seq, event in new_events],
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _load(self, job_id):
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT job_id, kind, status, owner_pid, created_at, started_at, finished_at, progress, "
+                "event_count, result, error FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        job_id, kind, status, owner_pid, created_at, started_at, finished_at, progress, event_count, result, error = row
+        state = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "progress": json.loads(progress),
+            "event_count": event_count,
+            "result": json.loads(result),
+            "error": error,
+        }
+        return state, owner_pid
+
+    def _events_since(self, job_id, seq):
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, seq))
+            return [json.loads(event) for event, in rows]
+        finally:
+            connection.close()
+
+    def _request_cancel(self, job_id):
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status IN ('pending', 'running')", (job_id,))
+            connection.commit()
+            row = connection.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row else None
+
+    def _cancel_requested(self, job_ids):
+        job_ids = list(job_ids)
+        connection = self._connect()
+        try:
+            placeholders = ",".join("?" * len(job_ids))
+            rows = connection.execute(
+                f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})", job_ids)
+            return {job_id for job_id, in rows}
+        finally:
+            connection.close()
+
+    def _purge(self, finished_before):
+        connection = self._connect()
+        try:
+            connection.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at < ?)",
+                (finished_before,))
+            connection.execute("DELETE FROM jobs WHERE finished_at < ?", (finished_before,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    # Store the state of jobs as (to_dict() state, [(seq, event), ...] not stored yet) pairs
+    async def save_many(self, jobs):
+        if not jobs:
+            return
+        try:
+            await asyncio.to_thread(self._save_many, jobs)
+        except sqlite3.Error as e:
+            logging.warning(f"Error writing job states: {e}")
+
+    # Return the state of a job as stored by its worker, or None if it is unknown. A job
+    # whose worker is gone without finishing it is reported as failed.
+    async def load(self, job_id):
+        try:
+            loaded = await asyncio.to_thread(self._load, job_id)
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading job {job_id}: {e}")
+            return None
+        if loaded is None:
+            return None
+        state, owner_pid = loaded
+        if state["status"] in ("pending", "running") and not process_alive(owner_pid):
+            state.update(status="failed", error="The worker running the job has stopped.", finished_at=time.time())
+        return state
+
+    # Progress events of a job from the given sequence number on
+    async def events_since(self, job_id, seq):
+        try:
+            return await asyncio.to_thread(self._events_since, job_id, seq)
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading events of job {job_id}: {e}")
+            return []
+
+    # Ask the owning worker to cancel a job; returns the job status, or None if it is unknown
+    async def request_cancel(self, job_id):
+        try:
+            return await asyncio.to_thread(self._request_cancel, job_id)
+        except sqlite3.Error as e:
+            logging.warning(f"Error cancelling job {job_id}: {e}")
+            return None
+
+    # IDs of the given jobs whose cancellation was requested by another worker
+    async def cancel_requested(self, job_ids):
+        if not job_ids:
+            return set()
+        try:
+            return await asyncio.to_thread(self._cancel_requested, job_ids)
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading job cancellations: {e}")
+            return set()
+
+    # Delete jobs that finished before the given time, with their events
+    async def purge(self, finished_before):
+        try:
+            await asyncio.to_thread(self._purge, finished_before)
+        except sqlite3.Error as e:
+            logging.warning(f"Error deleting old jobs: {e}")
+
+
+job_store = JobStore()
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from job_store import job_store, JobStore
+
+# Set limits for background jobs
+MAX_JOB_WORKERS = 4  # Jobs that run at the same time per process
+MAX_QUEUED_JOBS = 100  # Jobs waiting for a worker before new submissions are rejected
+MAX_LOGIN_JOBS = 20  # Jobs with a one-time password running at once per process; they are never queued
+JOB_RETENTION_SECONDS = 3600  # Finished jobs are kept this long for status queries
+JOB_SYNC_INTERVAL = 0.5  # Seconds between saving job progress for the other workers and checking their cancellations
+JOB_PURGE_INTERVAL = 60  # Seconds between deletions of expired jobs from the shared store
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+def format_progress_event(seq, event):
+    return f"event: progress\nid: {seq}\ndata: {json.dumps(event)}\n\n"
+
+
+def format_final_event(state):
+    return f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+
+
+# A unit of background work. The work function is called with a progress callback and
+# its return value becomes the job result; every progress event is kept so that
+# late subscribers of the event stream can replay them.
+class Job:
+    def __init__(self, kind, work):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._work = work
+        self._task = None
+        self._changed = asyncio.Condition()
+        self.saved_events = 0  # Events already in the shared job store
+        self.saved_status = None
+
+    # Record a progress event and wake up everyone streaming this job
+    def report(self, event):
+        self.events.append(event)
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    # Run the work in its own task so that cancelling the job does not cancel the worker
+    async def run(self):
+        if self.status != PENDING:
+            return
+        self.status = RUNNING
+        self.started_at = time.time()
+        self._task = asyncio.create_task(self._work(self.report))
+        try:
+            await asyncio.wait({self._task})
+        except asyncio.CancelledError:
+            # The worker itself is shutting down
+            self._task.cancel()
+            self.status = CANCELLED
+            raise
+        else:
+            if self._task.cancelled():
+                self.status = CANCELLED
+            elif self._task.exception() is not None:
+                e = self._task.exception()
+                logging.error(f"Job {self.id} ({self.kind}) failed: {e}", exc_info=e)
+                self.error = str(getattr(e, "detail", e))
+                self.status = FAILED
+            else:
+                self.result = self._task.result()
+                self.status = SUCCEEDED
+        finally:
+            self._task = None
+            self._work = None
+            self.finished_at = time.time()
+            asyncio.get_running_loop().create_task(self._notify())
+            logging.info(f"Job {self.id} ({self.kind}) finished with status {self.status}")
+
+    # Cancel a queued or running job; returns False if it already finished
+    def cancel(self):
+        if self.status in FINISHED_STATES:
+            return False
+        if self._task is not None:
+            self._task.cancel()
+        else:
+            self.status = CANCELLED
+            self._work = None
+            self.finished_at = time.time()
+            asyncio.get_running_loop().create_task(self._notify())
+        return True
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.events[-1] if self.events else None,
+            "event_count": len(self.events),
+            "result": self.result,
+            "error": self.error,
+        }
+
+    # Server-Sent-Events stream of all progress events, followed by the final job state
+    async def stream_events(self):
+        sent = 0
+        while True:
+            async with self._changed:
+                while sent == len(self.events) and self.status not in FINISHED_STATES:
+                    await self._changed.wait()
+            while sent < len(self.events):
+                yield format_progress_event(sent, self.events[sent])
+                sent += 1
+            if self.status in FINISHED_STATES:
+                yield format_final_event(self.to_dict())
+                return
+
+
+# Runs submitted jobs on a bounded number of worker tasks. Jobs run independently of
+# the HTTP request that submitted them, so they survive client disconnects. Jobs that
+# log in with a one-time password start right away in their own lane instead: waiting
+# behind other jobs would let the password expire. That lane is bounded by rejecting.
+# A job runs in the Gunicorn worker that accepted it; its state and progress are saved
+# to the shared job store every JOB_SYNC_INTERVAL seconds, so any worker can answer
+# status queries, stream its events and pass on cancellations.
+class JobManager:
+    def __init__(
+        self,
+        workers: int = MAX_JOB_WORKERS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        max_login_jobs: int = MAX_LOGIN_JOBS,
+        store: JobStore = job_store,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_login_jobs = max_login_jobs
+        self.store = store
+        self.jobs = {}  # Jobs of this worker
+        self._queue = None
+        self._worker_tasks = []
+        self._login_tasks = set()
+        self._sync_task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sync_task = asyncio.create_task(self._sync())
+        logging.info(f"Job manager started with {self.workers} workers")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await job.run()
+            finally:
+                self._queue.task_done()
+
+    # Queue a job, or with uses_otp=True start it right away
+    async def submit(self, kind, work, uses_otp=False):
+        if self._queue is None:
+            raise RuntimeError("Job manager has not been started.")
+        self._purge_finished_jobs()
+        job = Job(kind, work)
+        if uses_otp:
+            if len(self._login_tasks) >= self.max_login_jobs:
+                raise JobQueueFullError(f"Too many ILIAS login jobs running ({self.max_login_jobs}).")
+            task = asyncio.create_task(job.run())
+            self._login_tasks.add(task)
+            task.add_done_callback(self._login_tasks.discard)
+        else:
+            try:
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                raise JobQueueFullError(f"Too many queued jobs ({self.max_queued}).")
+        self.jobs[job.id] = job
+        # Other workers must know the job as soon as its id is handed out
+        await self._save([job])
+        logging.info(f"Job {job.id} ({kind}) submitted")
+        return job
+
+    # Job state as returned by Job.to_dict(), from whichever worker runs the job, or None
+    async def state(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return await self.store.load(job_id)
+
+    # Server-Sent-Events stream of a job of any worker, or None if the job is unknown
+    async def stream_events(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.stream_events()
+        if await self.store.load(job_id) is None:
+            return None
+        return self._stream_stored_events(job_id)
+
+    # Events of a job of another worker, read from the job store as they are saved
+    async def _stream_stored_events(self, job_id):
+        sent = 0
+        while True:
+            # The events are saved together with the state, so once a finished state is
+            # read, all events can be read as well
+            state = await self.store.load(job_id)
+            for event in await self.store.events_since(job_id, sent):
+                yield format_progress_event(sent, event)
+                sent += 1
+            if state is None:
+                return
+            if state["status"] in FINISHED_STATES:
+                yield format_final_event(state)
+                return
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+
+    # Cancel a job of any worker; returns its status before cancelling, or None if unknown.
+    # A job of another worker is cancelled once that worker sees the request.
+    async def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return await self.store.request_cancel(job_id)
+        status = job.status
+        job.cancel()
+        return status
+
+    # Save the jobs that changed since they were last saved
+    async def _save(self, jobs):
+        changes = []
+        for job in jobs:
+            event_count, status = len(job.events), job.status
+            if job.saved_events == event_count and job.saved_status == status:
+                continue
+            new_events = [(seq, job.events[seq]) for seq in range(job.saved_events, event_count)]
+            changes.append((job, event_count, status, (job.to_dict(), new_events)))
+        await self.store.save_many([change for _, _, _, change in changes])
+        for job, event_count, status, _ in changes:
+            job.saved_events = event_count
+            job.saved_status = status
+
+    async def _sync(self):
+        purged_at = 0
+        while True:
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+            await self._save(list(self.jobs.values()))
+            unfinished = [job_id for job_id, job in self.jobs.items() if job.status not in FINISHED_STATES]
+            for job_id in await self.store.cancel_requested(unfinished):
+                logging.info(f"Cancelling job {job_id} as requested by another worker")
+                self.jobs[job_id].cancel()
+            if time.monotonic() - purged_at >= JOB_PURGE_INTERVAL:
+                await self.store.purge(time.time() - JOB_RETENTION_SECONDS)
+                purged_at = time.monotonic()
+
+    def _purge_finished_jobs(self):
+        expired_before = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            if job.status in FINISHED_STATES and job.finished_at < expired_before:
+                del self.jobs[job_id]
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        for job in list(self.jobs.values()):
+            job.cancel()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._login_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        # Let the other workers see the final states
+        await self._save(list(self.jobs.values()))
+        logging.info("Job manager stopped")
+
+
+job_manager = JobManager()
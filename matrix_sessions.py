@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+
+from aiohttp import ClientConnectionError, ClientResponseError
+from nio import WhoamiResponse
+
+from script import login, logout, rate_limiter_for, drop_rate_limiter, invalidate_room_index
+
+# Set limits for reusable Matrix sessions
+MATRIX_SESSION_IDLE_TTL = 300  # Seconds an unused session stays logged in
+MATRIX_SESSION_VALIDATE_AFTER = 60  # Seconds of idleness after which a session is checked with whoami before reuse
+MATRIX_SESSION_MAX = 50  # Logged-in sessions kept per process; the least recently used idle one is logged out
+MATRIX_SESSION_SWEEP_INTERVAL = 30  # Seconds between checks for expired sessions
+
+# Per-process key for the password digests; passwords themselves are never kept
+_DIGEST_KEY = os.urandom(32)
+
+
+def _password_digest(password):
+    return hashlib.blake2b(password.encode("utf-8"), key=_DIGEST_KEY).digest()
+
+
+class MatrixSession:
+    def __init__(self, user_id, client, password_digest):
+        self.user_id = user_id
+        self.client = client
+        self.password_digest = password_digest
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.invalidated = False
+
+
+# In-process pool of logged-in Matrix clients, one per user. A sync borrows the user's
+# client, so back-to-back syncs skip the password login and reuse its keep-alive
+# connections and the warm room index. A session is only handed out to a caller who
+# presents the same password, and it is logged out after MATRIX_SESSION_IDLE_TTL
+# seconds without use or when it is invalidated.
+class MatrixSessionPool:
+    def __init__(self, idle_ttl: float = MATRIX_SESSION_IDLE_TTL, max_sessions: int = MATRIX_SESSION_MAX):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}  # user_id -> MatrixSession
+        self._by_client = {}  # id(client) -> MatrixSession
+        self._locks = {}
+        self._sweeper = None
+
+    async def start(self):
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    # Check an idle session before reuse, so a token revoked on the server is noticed
+    async def _is_valid(self, session):
+        if time.monotonic() - session.last_used < MATRIX_SESSION_VALIDATE_AFTER:
+            return True
+        try:
+            return isinstance(await rate_limiter_for(session.client).call(session.client.whoami), WhoamiResponse)
+        except (ClientConnectionError, ClientResponseError) as e:
+            logging.warning(f"Error validating Matrix session of {session.user_id}: {e}")
+            return False
+
+    # Return a logged-in client for the user, reusing their session when the password
+    # matches, or None if the login fails. Every client must be given back with release().
+    async def acquire(self, user_id: str, password: str):
+        password_digest = _password_digest(password)
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            session = self._sessions.get(user_id)
+            if session is not None and hmac.compare_digest(session.password_digest, password_digest):
+                if await self._is_valid(session):
+                    session.in_use += 1
+                    session.last_used = time.monotonic()
+                    logging.info(f"Reusing Matrix session of {user_id}")
+                    return session.client
+                # The token is no longer accepted, log in again
+                await self._discard(session)
+                session = None
+
+            client = await login(user_id, password)
+            if client is None:
+                # A wrong password does not end the session of the actual owner
+                return None
+            if session is not None:
+                # The password changed, the old session must not be handed out again
+                await self._discard(session)
+            session = MatrixSession(user_id, client, password_digest)
+            session.in_use = 1
+            self._sessions[user_id] = session
+            self._by_client[id(client)] = session
+        await self._evict_over_limit()
+        return client
+
+    # Give a client back; it stays logged in for the next sync unless it was invalidated
+    async def release(self, client):
+        session = self._by_client.get(id(client))
+        if session is None:
+            await logout(client)
+            return
+        session.in_use -= 1
+        session.last_used = time.monotonic()
+        if session.invalidated and session.in_use == 0:
+            await self._close(session)
+
+    # End the user's session when they sign out. Only the owner (same password) can end it;
+    # a session still in use is logged out as soon as it is released.
+    async def invalidate(self, user_id: str, password: str):
+        session = self._sessions.get(user_id)
+        if session is None or not hmac.compare_digest(session.password_digest, _password_digest(password)):
+            return False
+        # The next login starts from a fresh room index
+        invalidate_room_index(session.client.user_id)
+        await self._discard(session)
+        return True
+
+    async def _discard(self, session):
+        if self._sessions.get(session.user_id) is session:
+            del self._sessions[session.user_id]
+        session.invalidated = True
+        if session.in_use == 0:
+            await self._close(session)
+
+    async def _close(self, session):
+        self._by_client.pop(id(session.client), None)
+        drop_rate_limiter(session.client.user_id)
+        await logout(session.client)
+
+    async def _evict_over_limit(self):
+        idle_sessions = sorted(
+            (session for session in self._sessions.values() if session.in_use == 0), key=lambda session: session.last_used)
+        for session in idle_sessions[:max(0, len(self._sessions) - self.max_sessions)]:
+            logging.info(f"Logging out Matrix session of {session.user_id} to stay within {self.max_sessions} sessions")
+            await self._discard(session)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(MATRIX_SESSION_SWEEP_INTERVAL)
+            now = time.monotonic()
+            for session in list(self._sessions.values()):
+                if session.in_use == 0 and now - session.last_used >= self.idle_ttl:
+                    logging.info(f"Logging out idle Matrix session of {session.user_id}")
+                    await self._discard(session)
+
+    # Log out all sessions on shutdown
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for session in list(self._sessions.values()):
+            session.in_use = 0
+            await self._discard(session)
+
+
+matrix_sessions = MatrixSessionPool()
@@ -0,0 +1,81 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Latency buckets in seconds, from single Matrix calls up to full ILIAS logins
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_DURATION = Histogram(
+    "hnunisync_stage_duration_seconds", "Duration of ILIAS and Matrix sync stages", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_FAILURES = Counter("hnunisync_stage_failures_total", "Failed ILIAS and Matrix sync stages", ["stage"])
+MATRIX_RATE_LIMITED = Counter("hnunisync_matrix_rate_limited_total", "Matrix requests answered with a rate limit")
+MATRIX_RETRIES = Counter("hnunisync_matrix_retries_total", "Retried Matrix requests", ["reason"])
+LIVE_BROWSERS = Gauge("hnunisync_live_browsers", "Running Chromium browsers", multiprocess_mode="livesum")
+INFLIGHT_INVITES = Gauge("hnunisync_inflight_invites", "Matrix invites in progress", multiprocess_mode="livesum")
+ADMISSION_WAITING = Gauge(
+    "hnunisync_admission_waiting", "Requests waiting for a browser session", multiprocess_mode="livesum"
+)
+ADMISSION_REJECTED = Counter("hnunisync_admission_rejected_total", "Requests rejected by admission control", ["reason"])
+
+# Timing breakdown of the current request, if the client asked for one
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+# Measure a stage: observed in the latency histogram and, when the current request
+# collects a breakdown, added to it. Failures are counted per stage.
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.labels(stage).observe(duration)
+        timings = _request_timings.get()
+        if timings is not None:
+            entry = timings.setdefault(stage, {"count": 0, "total_seconds": 0.0})
+            entry["count"] += 1
+            entry["total_seconds"] += duration
+
+
+# Collect the per-stage timing breakdown of everything run inside the block, including
+# tasks started from it. Yields a dict that is filled in as stages finish.
+@contextmanager
+def collect_timings():
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def format_timings(timings):
+    return {
+        stage: {"count": entry["count"], "total_seconds": round(entry["total_seconds"], 3)}
+        for stage, entry in sorted(timings.items())
+    }
+
+
+# Prometheus text exposition; under Gunicorn set PROMETHEUS_MULTIPROC_DIR so that the
+# metrics of all worker processes are aggregated
+def render_metrics():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
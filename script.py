@@ -1,15 +1,26 @@
 from typing import List
 import asyncio
 import logging
+import time
 from nio import (
     AsyncClient,
+    AsyncClientConfig,
+    JoinedRoomsResponse,
     LoginResponse,
+    ProfileGetResponse,
     RoomCreateResponse,
+    RoomGetStateEventResponse,
+    RoomGetStateResponse,
     RoomInviteResponse,
+    RoomKickResponse,
     RoomPreset,
 )
+from nio.responses import ErrorResponse
 from aiohttp import ClientConnectionError, ClientResponseError
 
+from metrics import timed, MATRIX_RATE_LIMITED, MATRIX_RETRIES, INFLIGHT_INVITES, STAGE_FAILURES
+from user_cache import user_existence_cache
+
 # Matrix domain and server URL
 #matrix_domain = "localhost"  # Remote server domain
 matrix_domain = "unifyhn.de"  # Remote server domain
@@ -23,12 +34,165 @@ logging.basicConfig(
 )
 
 # Set limits for retries and concurrency
-MAX_CONCURRENT_INVITES = 2  # Adjust this value to control concurrent invites
 MAX_RETRIES = 5  # Max number of retries for rate-limited requests
+MAX_INLINE_INVITES = 50  # Users invited directly in the createRoom request of a new course room
+ROOM_INDEX_TTL = 300  # Seconds a user's room name index is reused before it is rebuilt
+
+# Set limits for the Matrix rate limiters
+RATE_LIMIT_INITIAL_RATE = 50  # Requests per second to start with (token bucket refill rate)
+RATE_LIMIT_MIN_RATE = 1
+RATE_LIMIT_MAX_RATE = 1000
+RATE_LIMIT_RATE_INCREASE = 1.05  # Factor the rate grows by with every successful request
+RATE_LIMIT_BURST = 20  # Token bucket size
+RATE_LIMIT_INITIAL_CONCURRENCY = 2  # Concurrent Matrix requests to start with
+RATE_LIMIT_MIN_CONCURRENCY = 1
+RATE_LIMIT_MAX_CONCURRENCY = 16
+RATE_LIMIT_DEFAULT_BACKOFF_MS = 1000  # Pause when the server rate limits without a retry_after_ms
+
+
+# Adaptive rate limiter for the Matrix API calls of one user. A token bucket caps the
+# request rate and a window caps the requests in flight. Both grow while requests
+# succeed (the rate by a small factor per request, the window by one per window of
+# requests) and are halved whenever the homeserver answers with M_LIMIT_EXCEEDED, in
+# which case all calls of the user also pause for retry_after_ms. The homeserver's 429s set the pace.
+class MatrixRateLimiter:
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_INITIAL_RATE,
+        burst: int = RATE_LIMIT_BURST,
+        initial_concurrency: int = RATE_LIMIT_INITIAL_CONCURRENCY,
+        min_concurrency: int = RATE_LIMIT_MIN_CONCURRENCY,
+        max_concurrency: int = RATE_LIMIT_MAX_CONCURRENCY,
+        min_rate: float = RATE_LIMIT_MIN_RATE,
+        max_rate: float = RATE_LIMIT_MAX_RATE,
+    ):
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(initial_concurrency)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    # Wait for a free concurrency slot and a token
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    timeout = self._paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    timeout = None
+                elif self._tokens < 1:
+                    timeout = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self.in_flight += 1
+                    return
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    # Give the slot back and adapt the rate and the concurrency to the outcome of the request
+    async def release(self, rate_limited: bool = False, retry_after_ms: int = None):
+        async with self._condition:
+            self.in_flight -= 1
+            if rate_limited:
+                now = time.monotonic()
+                # Requests that were already in flight when the first 429 came back belong
+                # to the same burst and do not halve the limits again
+                if now >= self._paused_until:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = 0.0
+                pause = (retry_after_ms or RATE_LIMIT_DEFAULT_BACKOFF_MS) / 1000
+                self._paused_until = max(self._paused_until, now + pause)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate * RATE_LIMIT_RATE_INCREASE)
+            self._condition.notify_all()
+
+    # Run a Matrix request through the limiter, retrying it when the server rate limits
+    async def call(self, request, *args, **kwargs):
+        response = None
+        for attempt in range(1, MAX_RETRIES + 1):
+            await self.acquire()
+            rate_limited = False
+            retry_after_ms = None
+            try:
+                response = await request(*args, **kwargs)
+                rate_limited = is_rate_limited(response)
+                if rate_limited:
+                    retry_after_ms = response.retry_after_ms
+            except ClientResponseError as e:
+                if e.status != 429 or attempt == MAX_RETRIES:
+                    raise
+                rate_limited = True
+                retry_after = e.headers.get("Retry-After") if e.headers else None
+                retry_after_ms = int(float(retry_after) * 1000) if retry_after else None
+            finally:
+                await self.release(rate_limited, retry_after_ms)
+
+            if not rate_limited:
+                return response
+            MATRIX_RATE_LIMITED.inc()
+            MATRIX_RETRIES.labels("rate_limited").inc()
+            logging.warning(
+                f"Rate limited by homeserver (attempt {attempt}/{MAX_RETRIES}), "
+                f"retrying after {retry_after_ms or RATE_LIMIT_DEFAULT_BACKOFF_MS} ms. "
+                f"Concurrency is now {int(self.concurrency)}, rate {self.rate:.1f} requests/s.")
+        return response
+
+
+class RoomAccessError(Exception):
+    pass
+
+
+# Check whether a matrix-nio response is a rate limit error
+def is_rate_limited(response):
+    return isinstance(response, ErrorResponse) and (
+        response.status_code == "M_LIMIT_EXCEEDED" or response.retry_after_ms is not None
+    )
+
+
+# Rate limiter per Matrix user: homeservers rate limit every account on its own, so one
+# user's 429s must not pause or throttle the syncs of the others
+matrix_rate_limiters = {}
+
+
+def rate_limiter_for(client: AsyncClient):
+    limiter = matrix_rate_limiters.get(client.user_id)
+    if limiter is None:
+        limiter = matrix_rate_limiters[client.user_id] = MatrixRateLimiter()
+    return limiter
+
 
-# Matrix login function
+# Forget the rate limiter of a user whose last session ended
+def drop_rate_limiter(user_id: str):
+    matrix_rate_limiters.pop(user_id, None)
+
+# Profile lookups in flight: user_id -> future of check_user_exists
+pending_user_lookups = {}
+
+# Room name index per Matrix user: user_id -> (built_at, {room_name: room_id})
+room_indexes = {}
+room_index_locks = {}
+
+# Matrix login function. Rate limited responses are returned right away instead of being
+# retried inside matrix-nio, so that the user's rate limiter sees them and backs off.
 async def login(username: str, password: str):
-    client = AsyncClient(homeserver, username)
+    client = AsyncClient(homeserver, username, config=AsyncClientConfig(max_limit_exceeded=0))
     try:
         response = await client.login(password)
         if isinstance(response, LoginResponse) and response.access_token:
@@ -43,8 +207,18 @@ async def login(username: str, password: str):
         await client.close()
         return None
 
-# Matrix room creation function with encryption
-async def create_room(client: AsyncClient, room_name: str, room_topic: str):
+# Encryption is set in the createRoom request itself, so the room never exists unencrypted
+ENCRYPTION_STATE_EVENT = {
+    "type": "m.room.encryption",
+    "state_key": "",
+    "content": {
+        "algorithm": "m.megolm.v1.aes-sha2"
+    }
+}
+
+# Matrix room creation function with encryption. Users in `invite` are invited by the
+# same createRoom request; this only happens when a new room is created.
+async def create_room(client: AsyncClient, room_name: str, room_topic: str, invite: List[str] = ()):
     # First, check if a room with the same name already exists
     existing_room_id = await find_room_by_name(client, room_name)
     if existing_room_id:
@@ -53,28 +227,18 @@ async def create_room(client: AsyncClient, room_name: str, room_topic: str):
 
     # Proceed with room creation if it does not exist
     try:
-        response = await client.room_create(
+        response = await rate_limiter_for(client).call(
+            client.room_create,
             name=room_name,
             topic=room_topic,
-            preset=RoomPreset.private_chat
+            preset=RoomPreset.private_chat,
+            invite=list(invite),
+            initial_state=[ENCRYPTION_STATE_EVENT]
         )
         if isinstance(response, RoomCreateResponse) and response.room_id:
             room_id = response.room_id
-            logging.info(f"Created room '{room_name}' with ID: {room_id}")
-
-            # Enable encryption in the room
-            encryption_response = await client.room_put_state(
-                room_id,
-                "m.room.encryption",
-                {
-                    "algorithm": "m.megolm.v1.aes-sha2"
-                }
-            )
-            if encryption_response:
-                logging.info(f"Encryption enabled for room '{room_name}' with ID: {room_id}")
-            else:
-                logging.error(f"Failed to enable encryption for room '{room_name}'")
-
+            logging.info(f"Created encrypted room '{room_name}' with ID: {room_id} and {len(invite)} inline invites")
+            add_room_to_index(client, room_name, room_id)
             return room_id
         else:
             logging.error(f"Failed to create room '{room_name}': {response}")
@@ -83,10 +247,84 @@ async def create_room(client: AsyncClient, room_name: str, room_topic: str):
         logging.exception(f"Error creating room '{room_name}': {e}")
         return None
 
+# Create a course room in a single request that also invites the first MAX_INLINE_INVITES
+# users. Returns the room ID and the users invited with it; the caller invites the rest.
+async def provision_room(client: AsyncClient, room_name: str, room_topic: str, user_list: List[str]):
+    with timed("matrix_provision_room"):
+        # Inviting a user who does not exist would make the whole createRoom request fail
+        existing_users, _ = await resolve_existing_users(client, user_list)
+        inline_invites = existing_users[:MAX_INLINE_INVITES]
+        room_id = await create_room(client, room_name, room_topic, invite=inline_invites)
+        if room_id:
+            return room_id, inline_invites
+
+        if inline_invites:
+            # The server may reject the request because of a single invitee, possibly after
+            # the room was created; use that room or create it without inline invites.
+            logging.warning(f"Creating room '{room_name}' with inline invites failed. Retrying without invites.")
+            room_id = (await get_room_index(client, refresh=True)).get(room_name)
+            if not room_id:
+                room_id = await create_room(client, room_name, room_topic)
+        return room_id, []
+
+# Check whether a Matrix user exists with a profile lookup. Returns True or False, or
+# None if the server did not tell (e.g. profile lookups are restricted).
+async def check_user_exists(client: AsyncClient, user_id: str):
+    try:
+        response = await rate_limiter_for(client).call(client.get_profile, user_id)
+    except (ClientConnectionError, ClientResponseError) as e:
+        logging.warning(f"Error looking up profile of {user_id}: {e}")
+        return None
+    if isinstance(response, ProfileGetResponse):
+        return True
+    if isinstance(response, ErrorResponse) and response.status_code == "M_NOT_FOUND":
+        return False
+    logging.debug(f"Could not determine whether {user_id} exists: {response}")
+    return None
+
+# Split the user list into users who exist (or might) and users known not to exist.
+# Results come from the persistent cache; unknown users are looked up concurrently
+# within the limits of the user's rate limiter and then cached, including misses.
+async def resolve_existing_users(client: AsyncClient, user_list: List[str]):
+    with timed("matrix_resolve_users"):
+        user_list = list(dict.fromkeys(user_list))
+        known = await user_existence_cache.get_many(user_list)
+        unknown = [user for user in user_list if user not in known]
+
+        if unknown:
+            # A user already being looked up for another course or sync is not looked up
+            # again; the lookup is shared until its result is in the cache
+            lookups = {}
+            owned = []
+            for user in unknown:
+                lookup = pending_user_lookups.get(user)
+                if lookup is None:
+                    lookup = pending_user_lookups[user] = asyncio.ensure_future(check_user_exists(client, user))
+                    owned.append(user)
+                lookups[user] = lookup
+            try:
+                # Shielded, so that a cancelled sync does not fail the lookups it shares
+                results = await asyncio.gather(*(asyncio.shield(lookup) for lookup in lookups.values()))
+                looked_up = {user: exists for user, exists in zip(lookups, results) if exists is not None}
+                await user_existence_cache.set_many({user: looked_up[user] for user in owned if user in looked_up})
+            finally:
+                for user in owned:
+                    pending_user_lookups.pop(user, None)
+            known.update(looked_up)
+
+        existing = [user for user in user_list if known.get(user) is not False]
+        missing = [user for user in user_list if known.get(user) is False]
+        if missing:
+            logging.info(f"Skipping {len(missing)} users without a Matrix account: {missing}")
+        return existing, missing
+
 # Fetch the list of rooms the user has joined
 async def get_joined_rooms(client: AsyncClient):
     try:
-        response = await client.joined_rooms()
+        response = await rate_limiter_for(client).call(client.joined_rooms)
+        if not isinstance(response, JoinedRoomsResponse):
+            logging.warning(f"Failed to get joined rooms for user {client.user_id}: {response}")
+            return []
         if response.rooms:
             logging.info(f"Retrieved joined rooms for user {client.user_id}")
             return response.rooms
@@ -97,67 +335,224 @@ async def get_joined_rooms(client: AsyncClient):
         logging.exception(f"Error getting joined rooms for user {client.user_id}: {e}")
         return []
 
+# Look up the name of a single room, returning None for unnamed or unreadable rooms
+async def get_room_name(client: AsyncClient, room_id: str):
+    try:
+        response = await rate_limiter_for(client).call(client.room_get_state_event, room_id, "m.room.name")
+        if isinstance(response, RoomGetStateEventResponse):
+            return response.content.get("name")
+        logging.debug(f"No name for room {room_id}: {response}")
+    except (ClientConnectionError, ClientResponseError) as e:
+        logging.warning(f"Error checking room name in room {room_id}: {e}")
+    return None
+
+# Build (or reuse) the room name index of the logged-in user. The names of all joined
+# rooms are looked up concurrently once and cached for ROOM_INDEX_TTL seconds.
+async def get_room_index(client: AsyncClient, refresh: bool = False):
+    lock = room_index_locks.setdefault(client.user_id, asyncio.Lock())
+    async with lock:
+        cached = room_indexes.get(client.user_id)
+        if cached and not refresh and time.monotonic() - cached[0] < ROOM_INDEX_TTL:
+            return cached[1]
+
+        with timed("matrix_room_index"):
+            index = await build_room_index(client)
+        room_indexes[client.user_id] = (time.monotonic(), index)
+        logging.info(f"Built room index for user {client.user_id} with {len(index)} named rooms")
+        return index
+
+# Look up the names of all joined rooms and map each name to its room ID
+async def build_room_index(client: AsyncClient):
+    joined_rooms = await get_joined_rooms(client)
+
+    # The lookups run concurrently within the limits of the user's rate limiter
+    async def lookup_task(room_id):
+        return room_id, await get_room_name(client, room_id)
+
+    room_names = await asyncio.gather(*(lookup_task(room_id) for room_id in joined_rooms))
+
+    # Keep the first room for each name, like the previous sequential scan did
+    index = {}
+    for room_id, name in room_names:
+        if name is not None and name not in index:
+            index[name] = room_id
+    return index
+
+# Record a newly created room in the cached index of the user, if there is one
+def add_room_to_index(client: AsyncClient, room_name: str, room_id: str):
+    cached = room_indexes.get(client.user_id)
+    if cached:
+        cached[1].setdefault(room_name, room_id)
+
+# Drop the cached room index of a user, e.g. after the user left one of its rooms
+def invalidate_room_index(user_id: str):
+    room_indexes.pop(user_id, None)
+
 # Check if a room with the desired name already exists
 async def find_room_by_name(client: AsyncClient, room_name: str):
-    joined_rooms = await get_joined_rooms(client)
-    for room_id in joined_rooms:
-        try:
-            response = await client.room_get_state_event(room_id, "m.room.name")
-            if response.content.get("name") == room_name:
-                logging.info(f"Room '{room_name}' already exists with ID: {room_id}")
-                return room_id
-        except (ClientConnectionError, ClientResponseError) as e:
-            logging.warning(f"Error checking room name '{room_name}' in room {room_id}: {e}")
+    with timed("matrix_find_room"):
+        index = await get_room_index(client)
+    room_id = index.get(room_name)
+    if room_id:
+        logging.info(f"Room '{room_name}' already exists with ID: {room_id}")
+        return room_id
     logging.info(f"Room '{room_name}' does not exist for user {client.user_id}")
     return None
 
-# Invite users to room with concurrency control and error handling
-async def invite_users_to_room(client: AsyncClient, room_id: str, user_list: List[str]):
+# Invite users to room; concurrency is controlled by the user's rate limiter
+async def invite_users_to_room(client: AsyncClient, room_id: str, user_list: List[str], progress=None):
     added_member_list_into_matrix_rooms = []
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_INVITES)
 
     async def invite_task(user):
-        async with semaphore:
-            await invite_single_user(client, room_id, user, added_member_list_into_matrix_rooms)
+        invited = await invite_single_user(client, room_id, user, added_member_list_into_matrix_rooms)
+        if progress:
+            progress({"stage": "user_invited", "room_id": room_id, "user": user, "invited": invited})
 
     tasks = [invite_task(user) for user in user_list]
     await asyncio.gather(*tasks)
     return added_member_list_into_matrix_rooms
 
-# Helper function to invite a single user with retries and exponential backoff
+# Fetch the current membership of a room as three sets: joined and invited user IDs and the
+# users with a power level above the room's default (moderators, admins), or None if it
+# cannot be read. Raises RoomAccessError if the user is no longer in the room; the
+# room then came from a stale room index, which is dropped.
+async def get_room_members(client: AsyncClient, room_id: str):
+    joined, invited = set(), set()
+    power_levels, default_level = {}, 0
+    try:
+        response = await rate_limiter_for(client).call(client.room_get_state, room_id)
+        if isinstance(response, ErrorResponse) and response.status_code == "M_FORBIDDEN":
+            invalidate_room_index(client.user_id)
+            raise RoomAccessError(f"User {client.user_id} has no access to room {room_id}: {response}")
+        if not isinstance(response, RoomGetStateResponse):
+            logging.warning(f"Failed to get members of room {room_id}: {response}")
+            return None
+        for event in response.events:
+            if event.get("type") == "m.room.power_levels":
+                power_levels = event.get("content", {}).get("users", {})
+                default_level = event.get("content", {}).get("users_default", 0)
+                continue
+            if event.get("type") != "m.room.member":
+                continue
+            membership = event.get("content", {}).get("membership")
+            if membership == "join":
+                joined.add(event["state_key"])
+            elif membership == "invite":
+                invited.add(event["state_key"])
+    except (ClientConnectionError, ClientResponseError) as e:
+        logging.warning(f"Error getting members of room {room_id}: {e}")
+        return None
+    privileged = {user for user, level in power_levels.items() if level > default_level}
+    return joined, invited, privileged
+
+# Bring the room membership in line with the user list: only users who are neither
+# joined nor invited are invited. For a room just created by provision_room, pass the
+# users invited with it as initial_invites; its state is then not fetched.
+# Returns the outcome per user group.
+async def sync_room_members(
+    client: AsyncClient,
+    room_id: str,
+    user_list: List[str],
+    progress=None,
+    initial_invites: List[str] = None,
+):
+    if initial_invites is not None:
+        joined, invited = set(), set(initial_invites)
+        if progress:
+            for user in initial_invites:
+                progress({"stage": "user_invited", "room_id": room_id, "user": user, "invited": True})
+    else:
+        members = await get_room_members(client, room_id)
+        if members is None:
+            # Membership unknown: fall back to inviting everyone
+            joined, invited = set(), set()
+        else:
+            joined, invited, _ = members
+    present = joined | invited
+    initially_invited = set(initial_invites or ())
+
+    candidates = [user for user in dict.fromkeys(user_list) if user not in present]
+    skipped = [user for user in dict.fromkeys(user_list) if user in present and user not in initially_invited]
+
+    # Users who have never signed up to Matrix are not invited at all
+    to_invite, missing = await resolve_existing_users(client, candidates)
+    logging.info(
+        f"Room {room_id}: {len(to_invite)} users to invite, {len(skipped)} already joined or invited, "
+        f"{len(missing)} without a Matrix account")
+
+    added = list(initial_invites or []) + await invite_users_to_room(client, room_id, to_invite, progress)
+    failed = [user for user in to_invite if user not in added]
+
+    return {
+        "added": added,
+        "skipped": skipped,
+        "failed": failed,
+        "missing": missing,
+    }
+
+# Remove the members of a room who are not in the wanted user list, e.g. students no
+# longer enrolled. Only plain members with an account on matrix_domain are ever removed:
+# the user, co-lecturers and tutors with a raised power level, and accounts on other
+# homeservers stay. Returns the removed users.
+async def remove_missing_members(client: AsyncClient, room_id: str, wanted: List[str]):
+    members = await get_room_members(client, room_id)
+    if members is None:
+        logging.warning(f"Not removing members from room {room_id}: its membership is unknown")
+        return []
+    joined, invited, privileged = members
+    removable = [
+        user for user in sorted((joined | invited) - set(wanted) - privileged - {client.user_id})
+        if user.endswith(f":{matrix_domain}")
+    ]
+    removed = []
+    for user in removable:
+        if await remove_user_from_room(client, room_id, user):
+            removed.append(user)
+    return removed
+
+# Remove a user who is no longer enrolled from the room
+async def remove_user_from_room(client: AsyncClient, room_id: str, user: str):
+    try:
+        response = await rate_limiter_for(client).call(
+            client.room_kick, room_id, user, reason="No longer enrolled in the ILIAS course")
+        if isinstance(response, RoomKickResponse):
+            logging.info(f"Removed {user} from room {room_id}")
+            return True
+        logging.warning(f"Failed to remove {user} from room {room_id}: {response}")
+    except (ClientConnectionError, ClientResponseError) as e:
+        logging.warning(f"Error removing {user} from room {room_id}: {e}")
+    return False
+
+# Helper function to invite a single user. Rate limits are retried by the rate limiter;
+# connection errors are retried here with exponential backoff. Returns whether the user was invited.
 async def invite_single_user(client, room_id, user, added_member_list_into_matrix_rooms):
-    retries = 0
-    success = False
+    with timed("matrix_invite"), INFLIGHT_INVITES.track_inprogress():
+        retries = 0
+
+        while retries < MAX_RETRIES:
+            try:
+                response = await rate_limiter_for(client).call(client.room_invite, room_id, user)
+            except (ClientConnectionError, ClientResponseError) as e:
+                retries += 1
+                MATRIX_RETRIES.labels("connection_error").inc()
+                backoff_time = 2 ** (retries - 1)  # Exponential backoff
+                logging.warning(f"Error inviting {user}: {e}. Retrying after {backoff_time} seconds.")
+                await asyncio.sleep(backoff_time)
+                continue
 
-    while retries < MAX_RETRIES and not success:
-        try:
-            response = await client.room_invite(room_id, user)
             if isinstance(response, RoomInviteResponse):
                 logging.info(f"Successfully invited {user} to room {room_id}")
                 added_member_list_into_matrix_rooms.append(user)
-                success = True
-            else:
-                logging.warning(f"Failed to invite {user}: {response}")
-                retries += 1
-                await asyncio.sleep(1)
-        except (ClientConnectionError, ClientResponseError) as e:
-            if "429" in str(e):
-                retry_after = int(e.headers.get("Retry-After", 1))
-                backoff_time = retry_after * (2 ** retries)  # Exponential backoff
-                logging.warning(f"Rate limited when inviting {user}. Retrying after {backoff_time} seconds.")
-                await asyncio.sleep(backoff_time)
-                retries += 1
-            elif "403" in str(e):
-                # Forbidden error (403)
-                logging.warning(f"Permission denied when inviting {user}. Skipping.")
-                break  # Do not retry on permission errors
-            else:
-                logging.exception(f"Error inviting {user}: {e}")
-                retries += 1
-                await asyncio.sleep(1)
+                return True
+
+            # Errors such as M_FORBIDDEN or unknown users do not go away by retrying
+            logging.warning(f"Failed to invite {user}: {response}")
+            STAGE_FAILURES.labels("matrix_invite").inc()
+            return False
 
-    if not success and retries >= MAX_RETRIES:
         logging.error(f"Failed to invite {user} after {MAX_RETRIES} attempts.")
+        STAGE_FAILURES.labels("matrix_invite").inc()
+        return False
 
 # Matrix logout function
 async def logout(client: AsyncClient):
@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from sqlite_store import SqliteStore
+
+SNAPSHOT_MAX_AGE = 24 * 3600  # Seconds a course snapshot is served before the course is scraped again; older ones are deleted
+
+
+# Hash of a member list that does not depend on the order of the rows
+def members_hash(members):
+    return hashlib.sha256("\n".join(sorted(members)).encode("utf-8")).hexdigest()
+
+
+# Persistent store of the last scraped member list of every course, keyed by ILIAS
+# user and course ref_id. The lists contain student emails, so a snapshot is only kept
+# for as long as it can be served.
+class SnapshotStore(SqliteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS ilias_course_snapshots ("
+        "ilias_user TEXT NOT NULL, ref_id TEXT NOT NULL, course_name TEXT NOT NULL, "
+        "members TEXT NOT NULL, member_count INTEGER NOT NULL, content_hash TEXT NOT NULL, "
+        "scraped_at REAL NOT NULL, PRIMARY KEY (ilias_user, ref_id))"
+    )
+
+    def _get_fresh(self, ilias_user, max_age):
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT ref_id, members FROM ilias_course_snapshots WHERE ilias_user = ? AND scraped_at >= ?",
+                (ilias_user, time.time() - max_age),
+            )
+            return {ref_id: json.loads(members) for ref_id, members in rows}
+        finally:
+            connection.close()
+
+    def _save_many(self, ilias_user, scraped_courses, max_age):
+        now = time.time()
+        changed = set()
+        connection = self._connect()
+        try:
+            for course, members in scraped_courses:
+                content_hash = members_hash(members)
+                row = connection.execute(
+                    "SELECT content_hash FROM ilias_course_snapshots WHERE ilias_user = ? AND ref_id = ?",
+                    (ilias_user, course['refId']),
+                ).fetchone()
+                if row is None or row[0] != content_hash:
+                    changed.add(course['refId'])
+                connection.execute(
+                    "INSERT OR REPLACE INTO ilias_course_snapshots "
+                    "(ilias_user, ref_id, course_name, members, member_count, content_hash, scraped_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (ilias_user, course['refId'], course['name'], json.dumps(members), len(members), content_hash, now),
+                )
+            # Snapshots too old to be served are not kept, of any user
+            connection.execute("DELETE FROM ilias_course_snapshots WHERE scraped_at < ?", (now - max_age,))
+            connection.commit()
+        finally:
+            connection.close()
+        return changed
+
+    # Return {ref_id: members} of the courses of a user scraped within max_age seconds
+    async def get_fresh(self, ilias_user, max_age=SNAPSHOT_MAX_AGE):
+        try:
+            return await asyncio.to_thread(self._get_fresh, ilias_user, max_age)
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading ILIAS snapshots of {ilias_user}: {e}")
+            return {}
+
+    # Store freshly scraped (course, members) pairs and delete snapshots older than max_age;
+    # returns the ref_ids whose members changed
+    async def save_many(self, ilias_user, scraped_courses, max_age=SNAPSHOT_MAX_AGE):
+        if not scraped_courses:
+            return set()
+        try:
+            return await asyncio.to_thread(self._save_many, ilias_user, scraped_courses, max_age)
+        except sqlite3.Error as e:
+            logging.warning(f"Error writing ILIAS snapshots of {ilias_user}: {e}")
+            return set()
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,23 @@
+import sqlite3
+
+# SQLite file shared by all requests and Gunicorn workers
+CACHE_DB_PATH = "hnunisync_cache.sqlite3"
+
+
+# Base of the stores kept in the SQLite cache file. Every call opens its own connection,
+# so a store can be used from worker threads and by several processes at the same time.
+# The first connection switches the file to WAL mode and creates the store's tables.
+class SqliteStore:
+    SCHEMA = None  # CREATE TABLE statements of the store's tables
+
+    def __init__(self, path: str = CACHE_DB_PATH):
+        self.path = path
+        self._initialized = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+            self._initialized = True
+        return connection
@@ -0,0 +1,10 @@
+import pytest
+
+
+# app mounts ./static on import
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static").mkdir()
+    import app
+    return app
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from browser_pool import BrowserPool, BrowserPoolBusyError
+
+
+class FakeContext:
+    async def add_init_script(self, script):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def is_connected(self):
+        return True
+
+    async def new_context(self, **kwargs):
+        return FakeContext()
+
+    async def close(self):
+        pass
+
+
+def started_pool(**kwargs):
+    pool = BrowserPool(size=1, max_contexts=1, **kwargs)
+    pool._condition = asyncio.Condition()
+    pool._browsers = [FakeBrowser()]
+    pool._open = [0]
+    pool._uses = [0]
+    return pool
+
+
+def test_requests_beyond_the_wait_queue_are_rejected_at_once():
+    async def run():
+        pool = started_pool(max_wait=5, max_waiting=2)
+        release = asyncio.Event()
+        served = []
+
+        async def login(name):
+            async with pool.context():
+                served.append(name)
+                await release.wait()
+
+        holder = asyncio.create_task(login("holder"))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(login(f"waiter{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+
+        started = time.monotonic()
+        with pytest.raises(BrowserPoolBusyError):
+            await login("rejected")
+        assert time.monotonic() - started < 1
+
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return served
+
+    assert asyncio.run(run()) == ["holder", "waiter0", "waiter1"]
+
+
+def test_waiting_requests_time_out():
+    async def run():
+        pool = started_pool(max_wait=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.context():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(BrowserPoolBusyError):
+            await pool._checkout()
+        assert not pool._waiters
+        release.set()
+        await holder
+
+    asyncio.run(run())
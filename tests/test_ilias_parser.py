@@ -0,0 +1,31 @@
+from benchmarks.fixtures import course_members_page
+from ilias_parser import extract_members_page
+
+
+def nav_link(value):
+    return f'<a href="ilias.php?baseClass=ilrepositorygui&amp;ref_id=7&amp;crs_7_table_nav={value}">x</a>'
+
+
+def test_paging_ignores_column_sort_links():
+    # The header's sort links come after the linkbar and point to offset 0
+    table_nav = " ".join([
+        nav_link("name:asc:50"),
+        nav_link("name:asc:150"),
+        nav_link("login:desc:0"),
+        nav_link("email:asc:0"),
+    ])
+    emails, paging = extract_members_page(course_members_page(50, table_nav=table_nav))
+
+    assert len(emails) == 50
+    assert paging == {
+        "nav_parameter": "crs_7_table_nav",
+        "rows_parameter": "crs_7_trows",
+        "order": "name:asc",
+        "limit": 50,
+        "offsets": [50, 100, 150],
+    }
+
+
+def test_single_page_with_sort_links_has_no_paging():
+    _, paging = extract_members_page(course_members_page(10, table_nav=nav_link("login:desc:0")))
+    assert paging is None
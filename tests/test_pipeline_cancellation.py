@@ -0,0 +1,52 @@
+import asyncio
+
+
+class FakeSessions:
+    def __init__(self):
+        self.released = False
+
+    async def acquire(self, user_id, password):
+        return object()
+
+    async def release(self, client):
+        self.released = True
+
+
+def test_cancelled_pipeline_does_not_sync_the_scraped_courses(app_module, monkeypatch):
+    sessions = FakeSessions()
+    synced = []
+    scraped = asyncio.Event()
+
+    async def run_ilias_scrape(sync_data, progress, course_queue):
+        for ref_id in range(10):
+            course_queue.put_nowait(({"name": f"Course {ref_id}", "refId": str(ref_id)}, ["s1@hs-heilbronn.de"], None))
+        scraped.set()
+        await asyncio.sleep(60)
+
+    async def sync_course_isolated(client, course, *args):
+        synced.append(course.course_id)
+        await asyncio.sleep(60)
+        return {}
+
+    monkeypatch.setattr(app_module, "matrix_sessions", sessions)
+    monkeypatch.setattr(app_module, "run_ilias_scrape", run_ilias_scrape)
+    monkeypatch.setattr(app_module, "sync_course_isolated", sync_course_isolated)
+    sync_data = app_module.IliasMatrixSyncData(
+        username="lecturer", password="secret", loginOtp="123456", matrixUserId="lecturer", matrixPassword="secret")
+
+    async def run():
+        task = asyncio.create_task(app_module.run_ilias_matrix_pipeline(sync_data))
+        await scraped.wait()
+        await asyncio.sleep(0.1)
+        started = len(synced)
+        task.cancel()
+        try:
+            await asyncio.wait_for(task, timeout=2)
+        except asyncio.CancelledError:
+            pass
+        return started
+
+    started = asyncio.run(run())
+    # Only the courses already in progress were started, and none after the cancellation
+    assert len(synced) == started < 10
+    assert sessions.released
@@ -0,0 +1,101 @@
+import asyncio
+
+from nio import JoinedRoomsResponse
+from nio.responses import ErrorResponse
+
+import script
+from benchmarks.fake_matrix import FakeMatrixHomeserver
+from script import MatrixRateLimiter, is_rate_limited
+
+
+def rate_limited_response(retry_after_ms=10):
+    return ErrorResponse("Too many requests", "M_LIMIT_EXCEEDED", retry_after_ms)
+
+
+def test_limiter_retries_rate_limited_responses_and_backs_off():
+    limiter = MatrixRateLimiter(rate=100, initial_concurrency=8)
+    responses = [rate_limited_response(), "ok"]
+    calls = []
+
+    async def request():
+        calls.append(1)
+        return responses[len(calls) - 1]
+
+    assert asyncio.run(limiter.call(request)) == "ok"
+    assert len(calls) == 2
+    # Halved on the 429, then one successful request
+    assert limiter.rate < 100
+    assert limiter.concurrency < 8
+
+
+def test_limiter_rate_grows_while_requests_succeed():
+    limiter = MatrixRateLimiter(rate=10, burst=100)
+
+    async def request():
+        return "ok"
+
+    async def run():
+        for _ in range(20):
+            await limiter.call(request)
+
+    asyncio.run(run())
+    assert limiter.rate > 10
+
+
+def test_login_client_hands_429_to_the_limiter(monkeypatch):
+    async def run():
+        homeserver = FakeMatrixHomeserver(retry_after_ms=10)
+        monkeypatch.setattr(script, "homeserver", await homeserver.start())
+        try:
+            client = await script.login("teacher", "secret")
+            assert client is not None
+
+            # matrix-nio must return the 429 instead of sleeping and retrying on its own
+            homeserver.rate_limit_ratio = 1.0
+            response = await asyncio.wait_for(client.joined_rooms(), timeout=5)
+            assert is_rate_limited(response)
+
+            # The limiter sees the 429 and backs off
+            limiter = MatrixRateLimiter(rate=100, initial_concurrency=8)
+            response = await asyncio.wait_for(limiter.call(client.joined_rooms), timeout=10)
+            assert is_rate_limited(response)
+            assert limiter.rate < 100 and limiter.concurrency < 8
+
+            homeserver.rate_limit_ratio = 0.0
+            assert isinstance(await limiter.call(client.joined_rooms), JoinedRoomsResponse)
+            await script.logout(client)
+        finally:
+            await homeserver.stop()
+
+    asyncio.run(run())
+
+
+def test_rate_limited_joined_rooms_do_not_fail_the_lookup(monkeypatch):
+    async def run():
+        homeserver = FakeMatrixHomeserver(retry_after_ms=1)
+        monkeypatch.setattr(script, "homeserver", await homeserver.start())
+        try:
+            client = await script.login("teacher", "secret")
+            homeserver.rate_limit_ratio = 1.0
+            assert await script.get_joined_rooms(client) == []
+            homeserver.rate_limit_ratio = 0.0
+            await script.logout(client)
+        finally:
+            await homeserver.stop()
+            script.drop_rate_limiter("@teacher:unifyhn.de")
+
+    asyncio.run(run())
+
+
+def test_rate_limiters_are_kept_per_user():
+    class Client:
+        def __init__(self, user_id):
+            self.user_id = user_id
+
+    first, second = Client("@a:unifyhn.de"), Client("@b:unifyhn.de")
+    try:
+        assert script.rate_limiter_for(first) is script.rate_limiter_for(Client("@a:unifyhn.de"))
+        assert script.rate_limiter_for(first) is not script.rate_limiter_for(second)
+    finally:
+        script.drop_rate_limiter(first.user_id)
+        script.drop_rate_limiter(second.user_id)
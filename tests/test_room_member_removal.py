@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import script
+from benchmarks.fake_matrix import FakeMatrixHomeserver
+from user_cache import user_existence_cache
+
+TEACHER = "@teacher:unifyhn.de"
+
+
+@pytest.fixture
+def homeserver(tmp_path, monkeypatch):
+    monkeypatch.setattr(user_existence_cache, "path", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(user_existence_cache, "_initialized", False)
+    return FakeMatrixHomeserver(registered_ratio=1.0)
+
+
+def run_with_homeserver(homeserver, monkeypatch, sync):
+    async def run():
+        monkeypatch.setattr(script, "homeserver", await homeserver.start())
+        try:
+            return await sync()
+        finally:
+            await homeserver.stop()
+
+    return asyncio.run(run())
+
+
+def test_only_plain_members_of_the_own_homeserver_are_removed(homeserver, monkeypatch):
+    room_id = homeserver.add_room("Course A", TEACHER, [
+        "@tutor:unifyhn.de", "@guest:matrix.org", "@s1:unifyhn.de", "@s2:unifyhn.de"])
+    homeserver.rooms[room_id]["power_levels"]["@tutor:unifyhn.de"] = 50
+
+    async def sync():
+        client = await script.login("teacher", "secret")
+        try:
+            return await script.remove_missing_members(client, room_id, ["@s2:unifyhn.de"])
+        finally:
+            await script.logout(client)
+
+    assert run_with_homeserver(homeserver, monkeypatch, sync) == ["@s1:unifyhn.de"]
+    members = homeserver.rooms[room_id]["members"]
+    assert members[TEACHER] == "join"
+    assert members["@tutor:unifyhn.de"] == "join"
+    assert members["@guest:matrix.org"] == "join"
+    assert members["@s1:unifyhn.de"] == "leave"
+
+
+def test_courses_with_the_same_name_keep_each_others_students(homeserver, monkeypatch, app_module):
+    room_id = homeserver.add_room("Course B", TEACHER, ["@s9:unifyhn.de"])
+    login_data = app_module.MatrixLoginData(
+        userId="teacher",
+        password="secret",
+        removeMissing=True,
+        courses=[
+            app_module.Course(course_name="Course B", course_id="1", students=["s1@hs-heilbronn.de"]),
+            app_module.Course(course_name="Course B", course_id="2", students=["s3@hs-heilbronn.de"]),
+        ],
+    )
+
+    async def sync():
+        try:
+            return await app_module.run_matrix_sync(login_data)
+        finally:
+            await app_module.matrix_sessions.stop()
+
+    response = run_with_homeserver(homeserver, monkeypatch, sync)
+    members = homeserver.rooms[room_id]["members"]
+    assert members["@s1:unifyhn.de"] == "invite"
+    assert members["@s3:unifyhn.de"] == "invite"
+    assert members["@s9:unifyhn.de"] == "leave"
+    assert response["summary"]["removed"] == 1
+
+
+def test_nothing_is_removed_from_a_room_whose_other_course_failed(homeserver, monkeypatch, app_module):
+    room_id = homeserver.add_room("Course C", TEACHER, ["@s1:unifyhn.de", "@s2:unifyhn.de"])
+    course = app_module.Course(course_name="Course C", course_id="1", students=["s1@hs-heilbronn.de"])
+    synced_courses = [
+        (course, {"course_name": "Course C", "course_id": "1", "room_name": "Course C", "room_id": room_id, "removed": 0}),
+        (None, {"course_name": "Course C", "course_id": "2", "error": "Scraping failed"}),
+    ]
+
+    async def sync():
+        client = await script.login("teacher", "secret")
+        try:
+            await app_module.remove_missing_room_members(client, synced_courses, "teacher")
+        finally:
+            await script.logout(client)
+
+    run_with_homeserver(homeserver, monkeypatch, sync)
+    assert homeserver.rooms[room_id]["members"]["@s2:unifyhn.de"] == "join"
+    assert synced_courses[0][1]["removed"] == 0
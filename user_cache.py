@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from sqlite_store import SqliteStore
+
+USER_EXISTS_TTL = 7 * 24 * 3600  # Seconds a user known to exist is not looked up again
+USER_MISSING_TTL = 6 * 3600  # Seconds a user known to be missing is skipped (they may sign up later)
+
+
+# Persistent cache of which Matrix user IDs exist on the homeserver, including
+# negative results.
+class UserExistenceCache(SqliteStore):
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS matrix_users ("
+        "user_id TEXT PRIMARY KEY, exists_on_server INTEGER NOT NULL, checked_at REAL NOT NULL)"
+    )
+
+    def _get_many(self, user_ids):
+        now = time.time()
+        known = {}
+        user_ids = list(user_ids)
+        connection = self._connect()
+        try:
+            # Query in chunks to stay below SQLite's limit of bound parameters
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    "SELECT user_id, exists_on_server, checked_at FROM matrix_users "
+                    f"WHERE user_id IN ({placeholders})",
+                    chunk,
+                )
+                for user_id, exists_on_server, checked_at in rows:
+                    ttl = USER_EXISTS_TTL if exists_on_server else USER_MISSING_TTL
+                    if now - checked_at < ttl:
+                        known[user_id] = bool(exists_on_server)
+        finally:
+            connection.close()
+        return known
+
+    def _set_many(self, results):
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO matrix_users (user_id, exists_on_server, checked_at) VALUES (?, ?, ?)",
+                [(user_id, int(exists_on_server), now) for user_id, exists_on_server in results.items()],
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    # Return {user_id: exists} for all user IDs with a fresh cache entry
+    async def get_many(self, user_ids):
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+        try:
+            return await asyncio.to_thread(self._get_many, user_ids)
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading the user existence cache: {e}")
+            return {}
+
+    # Store lookup results as {user_id: exists}
+    async def set_many(self, results):
+        if not results:
+            return
+        try:
+            await asyncio.to_thread(self._set_many, results)
+        except sqlite3.Error as e:
+            logging.warning(f"Error writing the user existence cache: {e}")
+
+    # Forget cached results, e.g. when a student reports having signed up
+    async def invalidate(self, user_ids):
+        def delete():
+            connection = self._connect()
+            try:
+                connection.executemany("DELETE FROM matrix_users WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+                connection.commit()
+            finally:
+                connection.close()
+
+        try:
+            await asyncio.to_thread(delete)
+        except sqlite3.Error as e:
+            logging.warning(f"Error invalidating the user existence cache: {e}")
+
+
+user_existence_cache = UserExistenceCache()